@@ -1,20 +1,56 @@
 import os
-from flask import Flask, request, jsonify, render_template
+from flask import (
+    Flask,
+    Response,
+    request,
+    jsonify,
+    render_template,
+    stream_with_context,
+)
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from supabase import create_client, Client
 from utils.pdf_processor import process_pdf
 from utils.llm_client import LLMClient
 from dotenv import load_dotenv
 from datetime import datetime, timezone
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+import time
 import uuid
 import traceback
 
 # Load environment variables
 load_dotenv()
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson for faster request/response bodies.
+
+    ``sort_keys`` (the provider attribute or a per-call kwarg) is honoured, so
+    responses keep Flask's sorted key order. Other ``json.dumps`` kwargs such
+    as ``indent`` or ``ensure_ascii`` have no orjson equivalent and are ignored.
+    """
+
+    def dumps(self, obj, **kwargs):
+        # Dates are passed through so they keep Flask's HTTP date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configure CORS with specific settings for file uploads
 CORS(
@@ -42,6 +78,30 @@ supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_
 # Initialize LLM client
 llm_client = LLMClient()
 
+# Shared HTTP session for blob storage calls so connections (and their TLS
+# handshakes) are reused across requests
+http_session = requests.Session()
+http_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        max_retries=Retry(total=2, backoff_factor=0.1),
+    ),
+)
+
+# Workers for database lookups that overlap with CPU-bound PDF parsing
+db_executor = ThreadPoolExecutor(max_workers=8)
+
+# Background workers for /api/process-pdf-async, and the jobs they are running.
+# Jobs live in this process only, so the async API needs a long-running server
+# (gunicorn and the like); on serverless deployments use /api/process-pdf.
+pdf_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
+# Seconds a finished job is kept for polling before it is discarded
+PDF_JOB_TTL = 15 * 60
+_pdf_jobs = {}
+_pdf_jobs_lock = threading.Lock()
+
 # Check if Blob token is available (required for production)
 BLOB_TOKEN = os.getenv("BLOB_READ_WRITE_TOKEN")
 if not BLOB_TOKEN:
@@ -52,6 +112,86 @@ else:
     print("✅ Blob storage configured successfully")
 
 
+# In-process cache of Q&A answers keyed by (feature, content_hash, params), so
+# repeating a question about the same material skips the OpenRouter call.
+# Flashcards and quizzes are not cached: each request should get a new set.
+# Pass "regenerate": true to bypass the cache.
+LLM_RESPONSE_CACHE_SIZE = 1024
+_llm_response_cache = OrderedDict()
+_llm_response_cache_lock = threading.Lock()
+
+
+def cached_llm_call(feature, content_hash, params, generate, refresh=False):
+    """
+    Return the cached result for this call, or run ``generate`` and cache it.
+
+    ``params`` holds the prompt inputs besides the material itself (such as
+    the question); the material is identified by ``content_hash``.
+    With ``refresh`` the cached result is ignored and replaced by a new one.
+    Failed generations (``None`` or empty results) are not cached so they can
+    be retried.
+    """
+    key = (feature, content_hash, *params)
+    if not refresh:
+        with _llm_response_cache_lock:
+            if key in _llm_response_cache:
+                _llm_response_cache.move_to_end(key)
+                print(f"♻️ Using cached {feature} result for {content_hash}")
+                return _llm_response_cache[key]
+
+    result = generate()
+
+    if result:
+        with _llm_response_cache_lock:
+            _llm_response_cache[key] = result
+            _llm_response_cache.move_to_end(key)
+            while len(_llm_response_cache) > LLM_RESPONSE_CACHE_SIZE:
+                _llm_response_cache.popitem(last=False)
+    return result
+
+
+def clear_llm_response_cache():
+    """Drop every cached LLM result."""
+    with _llm_response_cache_lock:
+        _llm_response_cache.clear()
+
+
+def _content_too_large(content):
+    """Return True if content cannot fit in the model's context window."""
+    return not LLMClient.can_process_entire_document(len(content))
+
+
+def _fit_to_context(content):
+    """
+    Trim content that would overflow the model's context window.
+
+    Flashcards and quizzes only need a representative slice of the material,
+    so oversized notes are cut (at the last paragraph break inside the budget
+    when there is one) instead of being rejected.
+    """
+    if not _content_too_large(content):
+        return content
+
+    max_chars = LLMClient.MAX_SINGLE_CALL_CHARS
+    cut = content.rfind("\n\n", max_chars // 2, max_chars)
+    truncated = content[: cut if cut != -1 else max_chars]
+    print(f"✂️ Truncated content from {len(content):,} to {len(truncated):,} chars")
+    return truncated
+
+
+def _content_too_large_response():
+    """Build the 413 response for content that exceeds the context window."""
+    return (
+        jsonify(
+            {
+                "error": "Content too large for the model context window",
+                "max_input_tokens": LLMClient.MAX_INPUT_TOKENS,
+            }
+        ),
+        413,
+    )
+
+
 # Error handler for file too large
 @app.errorhandler(413)
 def too_large(e):
@@ -213,7 +353,7 @@ def upload_to_vercel_blob(pathname, file_content, content_type, token):
     }
 
     # Upload the file
-    response = requests.put(f"{url}/{pathname}", data=file_content, headers=headers)
+    response = http_session.put(f"{url}/{pathname}", data=file_content, headers=headers)
 
     if response.status_code not in [200, 201]:
         raise Exception(f"Blob upload failed: {response.status_code} - {response.text}")
@@ -230,83 +370,252 @@ def upload_to_vercel_blob(pathname, file_content, content_type, token):
         return blob_url
 
 
-@app.route("/api/process-pdf", methods=["POST"])
-def process_pdf_endpoint():
+def _read_pdf_upload():
+    """
+    Validate a PDF processing form and read the uploaded file.
+
+    Returns ``((file_bytes, content_hash), None)`` when the request has a PDF,
+    an X-User-ID header, a subject and a content hash, and
+    ``(None, error_response)`` otherwise.
+    """
     if "file" not in request.files:
-        return jsonify({"error": "No file provided"}), 400
+        return None, (jsonify({"error": "No file provided"}), 400)
 
     file = request.files["file"]
     if not file.filename.endswith(".pdf"):
-        return jsonify({"error": "File must be a PDF"}), 400
+        return None, (jsonify({"error": "File must be a PDF"}), 400)
 
     # Get user_id from request
     user_id = request.headers.get("X-User-ID")
     if not user_id:
-        return jsonify({"error": "User ID not provided"}), 401
+        return None, (jsonify({"error": "User ID not provided"}), 401)
 
     # Get subject and content_hash from request
     subject = request.form.get("subject")
     content_hash = request.form.get("content_hash")
     if not subject:
-        return jsonify({"error": "Subject not provided"}), 400
+        return None, (jsonify({"error": "Subject not provided"}), 400)
     if not content_hash:
-        return jsonify({"error": "Content hash not provided"}), 400
+        return None, (jsonify({"error": "Content hash not provided"}), 400)
+
+    # Read the upload now; the request stream is closed once the view returns
+    return (file.read(), content_hash), None
+
+
+@app.route("/api/process-pdf", methods=["POST"])
+def process_pdf_endpoint():
+    upload, error = _read_pdf_upload()
+    if error:
+        return error
+    file_bytes, content_hash = upload
 
     try:
-        # Process PDF
-        file_bytes = file.read()
-        text, chunks, _ = process_pdf(
-            file_bytes
-        )  # We don't need the hash since it's provided
+        return jsonify(process_and_store_notes(file_bytes, content_hash))
 
-        # Check if notes exist in database
-        existing_notes = (
-            supabase.table("study_notes")
-            .select("*")
-            .eq("content_hash", content_hash)
-            .execute()
-        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        if existing_notes.data:
-            # Return existing notes
-            return jsonify(
-                {
-                    "status": "success",
-                    "message": "Retrieved existing notes",
-                    "content": existing_notes.data[0]["content"],
-                    "content_hash": content_hash,
-                    "model_used": existing_notes.data[0]["model_used"],
-                    "generated_at": existing_notes.data[0]["generated_at"],
-                }
+
+def process_and_store_notes(file_bytes, content_hash):
+    """
+    Extract a PDF's text and return its study notes, generating them if needed.
+
+    Existing notes for ``content_hash`` are returned as-is; otherwise notes are
+    generated from the PDF chunks and stored in the study_notes table.
+    Returns the JSON-ready result dict and raises on failure.
+    """
+    # Check if notes exist in database while the PDF is being parsed
+    existing_notes_future = db_executor.submit(
+        lambda: supabase.table("study_notes")
+        .select("*")
+        .eq("content_hash", content_hash)
+        .execute()
+    )
+
+    # Process PDF
+    text, chunks, _ = process_pdf(
+        file_bytes
+    )  # We don't need the hash since it's provided
+
+    existing_notes = existing_notes_future.result()
+
+    if existing_notes.data:
+        return _existing_notes_result(existing_notes.data[0], content_hash)
+
+    # Generate new notes
+    notes = llm_client.generate_notes_for_chunks(chunks)
+    combined_notes = "\n\n".join([f"\n\n{note}" for i, note in enumerate(notes)])
+
+    return _store_notes(content_hash, combined_notes)
+
+
+def _existing_notes_result(note, content_hash):
+    """Build the response body for notes that were already stored."""
+    return {
+        "status": "success",
+        "message": "Retrieved existing notes",
+        "content": note["content"],
+        "content_hash": content_hash,
+        "model_used": note["model_used"],
+        "generated_at": note["generated_at"],
+    }
+
+
+def _store_notes(content_hash, combined_notes):
+    """Save freshly generated notes and build the response body for them."""
+    supabase.table("study_notes").insert(
+        {
+            "content_hash": content_hash,
+            "content": combined_notes,
+            "model_used": LLMClient.MODEL,
+            "prompt_used": llm_client.get_prompt_template(),
+        }
+    ).execute()
+
+    return {
+        "status": "success",
+        "message": "Generated new notes",
+        "content": combined_notes,
+        "content_hash": content_hash,
+        "model_used": LLMClient.MODEL,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _sse_event(event):
+    """Encode one server-sent event carrying a JSON payload."""
+    return f"data: {orjson.dumps(event).decode()}\n\n"
+
+
+@app.route("/api/process-pdf-stream", methods=["POST"])
+def process_pdf_stream():
+    """
+    Process a PDF like /api/process-pdf, streaming the notes as they are written.
+
+    The response is a text/event-stream of JSON events: ``delta`` events carry
+    successive pieces of the notes (concatenated they equal the stored
+    content), then a single ``done`` event carries the same body
+    /api/process-pdf returns, or an ``error`` event if generation failed.
+    Existing notes are sent straight away as the ``done`` event.
+    """
+    upload, error = _read_pdf_upload()
+    if error:
+        return error
+    file_bytes, content_hash = upload
+
+    def events():
+        try:
+            existing_notes = (
+                supabase.table("study_notes")
+                .select("*")
+                .eq("content_hash", content_hash)
+                .execute()
             )
+            if existing_notes.data:
+                note = existing_notes.data[0]
+                yield _sse_event(
+                    {"type": "done", **_existing_notes_result(note, content_hash)}
+                )
+                return
+
+            _, chunks, _ = process_pdf(file_bytes)
+
+            # Same layout as generate_notes_for_chunks' joined notes
+            pieces = []
+            for i, chunk in enumerate(chunks):
+                separator = "\n\n" if i == 0 else "\n\n\n\n"
+                pieces.append(separator)
+                yield _sse_event({"type": "delta", "content": separator})
+
+                generated = False
+                for delta in llm_client.stream_study_notes(chunk):
+                    generated = True
+                    pieces.append(delta)
+                    yield _sse_event({"type": "delta", "content": delta})
+                if not generated:
+                    yield _sse_event(
+                        {
+                            "type": "error",
+                            "error": f"Failed to generate notes for chunk {i + 1}",
+                        }
+                    )
+                    return
 
-        # Generate new notes
-        notes = llm_client.generate_notes_for_chunks(chunks)
-        combined_notes = "\n\n".join([f"\n\n{note}" for i, note in enumerate(notes)])
+            result = _store_notes(content_hash, "".join(pieces))
+            yield _sse_event({"type": "done", **result})
 
-        # Store in study_notes table
-        supabase.table("study_notes").insert(
-            {
-                "content_hash": content_hash,
-                "content": combined_notes,
-                "model_used": LLMClient.MODEL,
-                "prompt_used": llm_client.get_prompt_template(),
-            }
-        ).execute()
+        except Exception as e:
+            yield _sse_event({"type": "error", "error": str(e)})
 
-        return jsonify(
-            {
-                "status": "success",
-                "message": "Generated new notes",
-                "content": combined_notes,
-                "content_hash": content_hash,
-                "model_used": LLMClient.MODEL,
-                "generated_at": datetime.now(timezone.utc).isoformat(),
-            }
-        )
+    return Response(stream_with_context(events()), mimetype="text/event-stream")
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/process-pdf-async", methods=["POST"])
+def process_pdf_async():
+    """Queue PDF processing on a background worker and return a job ID."""
+    upload, error = _read_pdf_upload()
+    if error:
+        return error
+    file_bytes, content_hash = upload
+    user_id = request.headers["X-User-ID"]
+
+    _evict_expired_jobs()
+
+    job_id = uuid.uuid4().hex
+    future = pdf_executor.submit(process_and_store_notes, file_bytes, content_hash)
+    with _pdf_jobs_lock:
+        _pdf_jobs[job_id] = {"user_id": user_id, "future": future, "finished_at": None}
+    future.add_done_callback(lambda _: _mark_job_finished(job_id))
+
+    print(f"📨 Queued PDF processing job {job_id} for content_hash: {content_hash}")
+    return jsonify({"status": "pending", "job_id": job_id}), 202
+
+
+def _mark_job_finished(job_id):
+    """Record when a job finished so unpolled results can expire."""
+    with _pdf_jobs_lock:
+        job = _pdf_jobs.get(job_id)
+        if job is not None:
+            job["finished_at"] = time.monotonic()
+
+
+def _evict_expired_jobs():
+    """Drop finished jobs nobody collected within PDF_JOB_TTL seconds."""
+    cutoff = time.monotonic() - PDF_JOB_TTL
+    with _pdf_jobs_lock:
+        expired = [
+            job_id
+            for job_id, job in _pdf_jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del _pdf_jobs[job_id]
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Return the status, or the result once finished, of a queued PDF job."""
+    user_id = request.headers.get("X-User-ID")
+    if not user_id:
+        return jsonify({"error": "User ID not provided"}), 401
+
+    _evict_expired_jobs()
+
+    with _pdf_jobs_lock:
+        job = _pdf_jobs.get(job_id)
+        # Someone else's job is reported as missing so ids can't be probed
+        if job is None or job["user_id"] != user_id:
+            return jsonify({"error": "Job not found"}), 404
+        future = job["future"]
+        if not future.done():
+            return jsonify({"status": "pending", "job_id": job_id})
+        # Finished jobs are handed out once and then forgotten
+        del _pdf_jobs[job_id]
+
+    error = future.exception()
+    if error is not None:
+        return jsonify({"status": "error", "job_id": job_id, "error": str(error)}), 500
+    return jsonify({**future.result(), "job_id": job_id})
 
 
 @app.route("/api/notes/<content_hash>", methods=["GET"])
@@ -360,7 +669,7 @@ def process_pdf_from_blob():
 
     try:
         # Download PDF from blob URL
-        response = requests.get(blob_url)
+        response = http_session.get(blob_url)
         if response.status_code != 200:
             return jsonify({"error": "Failed to download file from blob URL"}), 400
 
@@ -442,7 +751,7 @@ def generate_hash_from_blob():
 
     try:
         # Download PDF from blob URL
-        response = requests.get(blob_url)
+        response = http_session.get(blob_url)
         if response.status_code != 200:
             return jsonify({"error": "Failed to download file from blob URL"}), 400
 
@@ -482,6 +791,78 @@ def generate_hash():
         return jsonify({"error": str(e)}), 500
 
 
+DEFAULT_FLASHCARD_CATEGORY = "Study Material"
+
+
+def _flashcard_category(content_hash, category):
+    """
+    Return the flashcard category for a material, and the material's info.
+
+    When the material is listed in study_materials its subject and title
+    ("Subject - Topic") replace ``category``; otherwise ``category`` is kept.
+    """
+    material_info = None
+    try:
+        material_response = (
+            supabase.table("study_materials")
+            .select("subject, title")
+            .eq("content_hash", content_hash)
+            .single()
+            .execute()
+        )
+        if material_response.data:
+            material_info = material_response.data
+            # Create a descriptive category based on subject and title
+            subject = material_info["subject"] or DEFAULT_FLASHCARD_CATEGORY
+            title = material_info["title"] or ""
+
+            # Create a broad category like "Subject - Topic"
+            if title and subject != title:
+                # Try to extract the main topic from the title
+                title_clean = (
+                    title.replace(".pdf", "")
+                    .replace("_", " ")
+                    .replace("-", " ")
+                    .strip()
+                )
+                category = f"{subject} - {title_clean}"
+            else:
+                category = subject
+    except Exception as e:
+        print(f"⚠️ Could not fetch material info: {e}")
+        # Continue with default category
+    return category, material_info
+
+
+def _save_flashcards(user_id, flashcards, category):
+    """Insert generated flashcards for a user and return the saved rows."""
+    saved_flashcards = []
+    for card in flashcards:
+        try:
+            # Insert flashcard into database
+            response = (
+                supabase.table("flashcards")
+                .insert(
+                    {
+                        "user_id": user_id,
+                        "front": card["front"],
+                        "back": card["back"],
+                        "category": card.get("category", category),
+                        "difficulty": card.get("difficulty", "medium"),
+                    }
+                )
+                .execute()
+            )
+
+            if response.data:
+                saved_flashcards.append(response.data[0])
+
+        except Exception as e:
+            print(f"⚠️ Error saving flashcard: {e}")
+            continue
+    return saved_flashcards
+
+
 @app.route("/api/generate-flashcards-from-material/<content_hash>", methods=["POST"])
 def generate_flashcards_from_material(content_hash):
     """Generate flashcards from existing study material."""
@@ -491,7 +872,7 @@ def generate_flashcards_from_material(content_hash):
             return jsonify({"error": "User ID not provided"}), 401
 
         data = request.get_json() or {}
-        category = data.get("category", "Study Material")
+        category = data.get("category", DEFAULT_FLASHCARD_CATEGORY)
 
         # Fetch the study material content and associated material info
         response = (
@@ -505,39 +886,9 @@ def generate_flashcards_from_material(content_hash):
             return jsonify({"error": "Study material not found"}), 404
 
         study_material = response.data[0]
-        content = study_material["content"]
+        content = _fit_to_context(study_material["content"])
 
-        # Try to get the subject from the study_materials table
-        material_info = None
-        try:
-            material_response = (
-                supabase.table("study_materials")
-                .select("subject, title")
-                .eq("content_hash", content_hash)
-                .single()
-                .execute()
-            )
-            if material_response.data:
-                material_info = material_response.data
-                # Create a descriptive category based on subject and title
-                subject = material_info["subject"] or "Study Material"
-                title = material_info["title"] or ""
-
-                # Create a broad category like "Subject - Topic"
-                if title and subject != title:
-                    # Try to extract the main topic from the title
-                    title_clean = (
-                        title.replace(".pdf", "")
-                        .replace("_", " ")
-                        .replace("-", " ")
-                        .strip()
-                    )
-                    category = f"{subject} - {title_clean}"
-                else:
-                    category = subject
-        except Exception as e:
-            print(f"⚠️ Could not fetch material info: {e}")
-            # Continue with default category
+        category, material_info = _flashcard_category(content_hash, category)
 
         print(f"🃏 Generating flashcards from study material")
         print(f"   Content hash: {content_hash}")
@@ -551,31 +902,7 @@ def generate_flashcards_from_material(content_hash):
         if not flashcards:
             return jsonify({"error": "Failed to generate flashcards"}), 500
 
-        # Save flashcards to database
-        saved_flashcards = []
-        for card in flashcards:
-            try:
-                # Insert flashcard into database
-                response = (
-                    supabase.table("flashcards")
-                    .insert(
-                        {
-                            "user_id": user_id,
-                            "front": card["front"],
-                            "back": card["back"],
-                            "category": card.get("category", category),
-                            "difficulty": card.get("difficulty", "medium"),
-                        }
-                    )
-                    .execute()
-                )
-
-                if response.data:
-                    saved_flashcards.append(response.data[0])
-
-            except Exception as e:
-                print(f"⚠️ Error saving flashcard: {e}")
-                continue
+        saved_flashcards = _save_flashcards(user_id, flashcards, category)
 
         if saved_flashcards:
             print(f"✅ Successfully saved {len(saved_flashcards)} flashcards")
@@ -659,6 +986,8 @@ def generate_quiz():
         if not study_content:
             return jsonify({"error": "No content available for quiz generation"}), 400
 
+        study_content = _fit_to_context(study_content)
+
         # Verify user has access to this content by checking if they have a study_material with this content_hash
         try:
             material_check = (
@@ -720,8 +1049,6 @@ def generate_quiz():
             return jsonify({"error": "Failed to generate quiz questions"}), 500
 
         # Generate unique quiz ID
-        import uuid
-
         quiz_id = str(uuid.uuid4())
 
         print(f"✅ Successfully generated quiz with {len(questions)} questions")
@@ -741,12 +1068,60 @@ def generate_quiz():
         print(f"❌ Error in generate_quiz endpoint: {e}")
         print(f"❌ Error type: {type(e)}")
         print(f"❌ Error traceback:")
-        import traceback
-
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 
+def _find_material_id(content_hash):
+    """Return the study_materials id for a content hash, or None."""
+    # Try to get the material ID, but don't fail if it doesn't exist
+    material_id = None
+    try:
+        material_response = (
+            supabase.table("study_materials")
+            .select("id, user_id, name")
+            .eq("content_hash", content_hash)
+            .execute()
+        )
+
+        print(f"📊 Material search results: {material_response.data}")
+
+        if material_response.data:
+            material_id = material_response.data[0]["id"]
+            print(f"✅ Found associated material with ID: {material_id}")
+        else:
+            print(
+                f"⚠️ No material found for content_hash, will use study_note_id instead"
+            )
+    except Exception as e:
+        print(f"⚠️ Error looking up material: {e}")
+    return material_id
+
+
+def _save_qa_session(material_id, study_note_id, question, answer):
+    """
+    Insert a Q&A session, linked to the material if known, else the note.
+
+    Returns the inserted rows, which are empty if nothing was saved.
+    """
+    qa_insert = (
+        supabase.table("qa_sessions")
+        .insert(
+            {
+                "material_id": material_id,  # This will be None if no material found
+                "study_note_id": study_note_id if not material_id else None,
+                "question": question,
+                "answer": answer,
+            }
+        )
+        .execute()
+    )
+    print(f"✅ Successfully saved Q&A session: {qa_insert.data}")
+    if not qa_insert.data:
+        print(f"⚠️ Q&A insert returned no data but no error")
+    return qa_insert.data
+
+
 @app.route("/api/ask-question", methods=["POST"])
 def ask_question():
     data = request.get_json()
@@ -774,33 +1149,21 @@ def ask_question():
     note = response.data[0]
     notes_content = note["content"]
     study_note_id = note["id"]
+    if _content_too_large(notes_content):
+        return _content_too_large_response()
     print(f"✅ Found study note with ID: {study_note_id}")
 
-    # Try to get the material ID, but don't fail if it doesn't exist
-    material_id = None
-    try:
-        material_response = (
-            supabase.table("study_materials")
-            .select("id, user_id, name")
-            .eq("content_hash", content_hash)
-            .execute()
-        )
-
-        print(f"📊 Material search results: {material_response.data}")
-
-        if material_response.data:
-            material_id = material_response.data[0]["id"]
-            print(f"✅ Found associated material with ID: {material_id}")
-        else:
-            print(
-                f"⚠️ No material found for content_hash, will use study_note_id instead"
-            )
-    except Exception as e:
-        print(f"⚠️ Error looking up material: {e}")
+    material_id = _find_material_id(content_hash)
 
     # Call LLM to answer the question
     print(f"🧠 Generating answer using LLM...")
-    answer = llm_client.answer_question(notes_content, question)
+    answer = cached_llm_call(
+        "qa",
+        content_hash,
+        (question,),
+        lambda: llm_client.answer_question(notes_content, question),
+        refresh=bool(data.get("regenerate")),
+    )
     if answer is None:
         print(f"❌ LLM failed to generate answer")
         return jsonify({"error": "Failed to generate answer from LLM"}), 500
@@ -812,21 +1175,7 @@ def ask_question():
     )
 
     try:
-        qa_insert = (
-            supabase.table("qa_sessions")
-            .insert(
-                {
-                    "material_id": material_id,  # This will be None if no material found
-                    "study_note_id": study_note_id if not material_id else None,
-                    "question": question,
-                    "answer": answer,
-                }
-            )
-            .execute()
-        )
-        print(f"✅ Successfully saved Q&A session: {qa_insert.data}")
-        if not qa_insert.data:
-            print(f"⚠️ Q&A insert returned no data but no error")
+        _save_qa_session(material_id, study_note_id, question, answer)
     except Exception as e:
         print(f"❌ Failed to save Q&A session: {e}")
         # Return error instead of continuing
@@ -835,6 +1184,140 @@ def ask_question():
     return jsonify({"status": "success", "answer": answer})
 
 
+@app.route("/api/generate-all/<content_hash>", methods=["POST"])
+def generate_all(content_hash):
+    """Generate flashcards, a quiz and (optionally) an answer in one request.
+
+    The study notes are fetched once and the LLM calls run concurrently, so
+    the request costs roughly one round trip instead of three. Flashcards and
+    the answer are saved for the user like the single-feature endpoints do,
+    and the quiz gets a ``quiz_id`` like /generate-quiz. The quiz subject and
+    title come from the request, then from study_materials, and only fall
+    back to the category when neither has them. Features that failed to
+    generate or save are listed in ``errors``; the status is 207 when only
+    some failed and 502 when all did.
+    """
+    user_id = request.headers.get("X-User-ID")
+    if not user_id:
+        return jsonify({"error": "User ID not provided"}), 401
+
+    data = request.get_json(silent=True) or {}
+    category = data.get("category", DEFAULT_FLASHCARD_CATEGORY)
+    question = data.get("question")
+
+    try:
+        response = (
+            supabase.table("study_notes")
+            .select("*")
+            .eq("content_hash", content_hash)
+            .execute()
+        )
+        if not response.data:
+            return jsonify({"error": "Study material not found"}), 404
+
+        note = response.data[0]
+        content = note["content"]
+        # Answers must see the whole notes; the other features can be trimmed
+        if question and _content_too_large(content):
+            return _content_too_large_response()
+        content = _fit_to_context(content)
+        category, material_info = _flashcard_category(content_hash, category)
+        material_info = material_info or {}
+        material_subject = (
+            data.get("material_subject") or material_info.get("subject") or category
+        )
+        material_title = (
+            data.get("material_title") or material_info.get("title") or category
+        )
+
+        print(f"🚀 Generating all features for content_hash: {content_hash}")
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            flashcards_future = executor.submit(
+                llm_client.generate_flashcards, content, category
+            )
+            quiz_future = executor.submit(
+                llm_client.generate_quiz, content, material_subject, material_title
+            )
+            answer_future = (
+                executor.submit(
+                    cached_llm_call,
+                    "qa",
+                    content_hash,
+                    (question,),
+                    lambda: llm_client.answer_question(content, question),
+                    refresh=bool(data.get("regenerate")),
+                )
+                if question
+                else None
+            )
+
+            flashcards = flashcards_future.result()
+            questions = quiz_future.result()
+            answer = answer_future.result() if answer_future else None
+
+        errors = {}
+        saved_flashcards = []
+        if not flashcards:
+            errors["flashcards"] = "Failed to generate flashcards"
+        else:
+            saved_flashcards = _save_flashcards(user_id, flashcards, category)
+            if not saved_flashcards:
+                errors["flashcards"] = "Failed to save flashcards to database"
+
+        quiz_id = None
+        if not questions:
+            errors["questions"] = "Failed to generate quiz questions"
+        else:
+            quiz_id = str(uuid.uuid4())
+
+        if question:
+            if answer is None:
+                errors["answer"] = "Failed to generate answer from LLM"
+            else:
+                try:
+                    saved_qa = _save_qa_session(
+                        _find_material_id(content_hash),
+                        note.get("id"),
+                        question,
+                        answer,
+                    )
+                except Exception as e:
+                    print(f"❌ Failed to save Q&A session: {e}")
+                    saved_qa = None
+                if not saved_qa:
+                    errors["answer"] = "Failed to save Q&A to database"
+                    answer = None
+
+        requested = 3 if question else 2
+        if len(errors) == requested:
+            return (
+                jsonify(
+                    {"error": "Failed to generate study features", "errors": errors}
+                ),
+                502,
+            )
+
+        return (
+            jsonify(
+                {
+                    "status": "partial" if errors else "success",
+                    "content_hash": content_hash,
+                    "flashcards": saved_flashcards,
+                    "quiz_id": quiz_id,
+                    "questions": questions or [],
+                    "answer": answer,
+                    "errors": errors,
+                }
+            ),
+            207 if errors else 200,
+        )
+
+    except Exception as e:
+        print(f"❌ Error in generate_all endpoint: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/api/qa-list", methods=["GET"])
 def qa_list():
     content_hash = request.args.get("content_hash")
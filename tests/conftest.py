@@ -0,0 +1,199 @@
+"""
+Shared pytest fixtures for the LLM Study Coach test suite.
+"""
+
+import mmap
+import os
+import sys
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+import responses
+from pytest_socket import disable_socket
+
+from utils.pdf_processor import extract_text_from_pdf, generate_content_hash
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Completion envelope returned by the mocked OpenRouter API on success.
+_LLM_SUCCESS_PAYLOAD = {
+    "choices": [{"message": {"content": "Generated study notes for the content"}}]
+}
+
+
+# Realistic single-page PDF shared by the integration tests. Tests wrap it in
+# io.BytesIO per request when they need a stream.
+_SAMPLE_PDF_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "sample.pdf")
+
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase client used by app.py.
+
+    Rows are seeded per table in ``tables``. Every select returns all rows of
+    its table (filters are ignored) and ``single()`` returns the first row.
+    Inserts are recorded in ``inserted`` instead of being added to the table,
+    and setting ``error`` makes every ``execute()`` raise it.
+    """
+
+    def __init__(self, **tables):
+        self.tables = {name: list(rows) for name, rows in tables.items()}
+        self.inserted = defaultdict(list)
+        self.error = None
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+
+class _FakeQuery:
+    """Chainable query returned by FakeSupabase.table()."""
+
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+        self._single = False
+        self._row = None
+        self._delete = False
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def insert(self, row):
+        self._row = row
+        return self
+
+    def delete(self):
+        self._delete = True
+        return self
+
+    def execute(self):
+        if self._db.error is not None:
+            raise self._db.error
+        if self._row is not None:
+            saved = self._db.inserted[self._name]
+            saved.append(self._row)
+            return SimpleNamespace(data=[{"id": str(len(saved)), **self._row}])
+        if self._delete:
+            return SimpleNamespace(data=[])
+        rows = self._db.tables.get(self._name, [])
+        if self._single:
+            return SimpleNamespace(data=rows[0] if rows else None)
+        return SimpleNamespace(data=list(rows))
+
+
+def pytest_runtest_setup(item):
+    # Fail fast on any forgotten mock instead of hanging on a real connection.
+    # Unix sockets stay available for event loops and xdist.
+    disable_socket(allow_unix_socket=True)
+
+
+def pytest_collection_modifyitems(config, items):
+    # Under --dist loadgroup, put every serial test in one group so they run
+    # on a single worker, one after another.
+    for item in items:
+        if item.get_closest_marker("serial"):
+            item.add_marker(pytest.mark.xdist_group("serial"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def openrouter_api_key():
+    """Set a dummy OpenRouter key once for the whole session.
+
+    Tests that need the key missing or empty still override it locally with
+    ``patch.dict`` or ``monkeypatch``.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("OPENROUTER_API_KEY", "test-api-key")
+        yield "test-api-key"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def no_retry_backoff():
+    """Retry transient LLM failures immediately instead of backing off."""
+    from utils.llm_client import LLMClient
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(LLMClient, "RETRY_BACKOFF", 0)
+        yield
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_response_cache():
+    """Start every test with an empty app-level LLM response cache."""
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.clear_llm_response_cache()
+
+
+@pytest.fixture(scope="session")
+def client():
+    """Create one Flask test client shared by the whole session.
+
+    Tests that need an isolated request can use
+    ``client.application.test_request_context()`` locally.
+    """
+    from app import app
+
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def sample_pdf():
+    """Return the shared sample PDF bytes, mapped from disk once per session."""
+    with open(_SAMPLE_PDF_PATH, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return bytes(mapped)
+
+
+@pytest.fixture(scope="session")
+def sample_pdf_hash(sample_pdf):
+    """Return the content hash /api/generate-hash reports for sample_pdf."""
+    return generate_content_hash(extract_text_from_pdf(sample_pdf))
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    """Replace app.supabase with an empty FakeSupabase for one test."""
+    fake = FakeSupabase()
+    monkeypatch.setattr("app.supabase", fake)
+    return fake
+
+
+@pytest.fixture
+def llm_api():
+    """Intercept outgoing requests calls at the transport level.
+
+    Requests to URLs that were not registered raise ConnectionError, so a test
+    that forgets to stub the LLM fails loudly instead of getting a MagicMock.
+    """
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        yield rsps
+
+
+@pytest.fixture
+def patched_services(monkeypatch, fake_supabase, llm_api):
+    """Patch every external service the Flask app talks to.
+
+    Test classes opt in with ``@pytest.mark.usefixtures("patched_services")``
+    and request ``fake_supabase`` / ``llm_api`` by name when they need to
+    configure them.
+    """
+
+
+@pytest.fixture
+def mock_llm_success(llm_api):
+    """Register a successful completion for the OpenRouter endpoint."""
+    llm_api.add(responses.POST, OPENROUTER_URL, json=_LLM_SUCCESS_PAYLOAD)
+    return llm_api
@@ -6,20 +6,16 @@ Tests all endpoints, error cases, and edge cases.
 import pytest
 import io
 import os
-from unittest.mock import patch, MagicMock
+import orjson
+from concurrent.futures import Future
+from unittest.mock import patch
 from flask import Flask
+import app as app_module
 from app import app, supabase, llm_client
+from utils.llm_client import IncompleteStreamError, LLMClient
 
 
 # Test configuration
-@pytest.fixture
-def client():
-    """Create a test client for the Flask app."""
-    app.config["TESTING"] = True
-    with app.test_client() as client:
-        yield client
-
-
 @pytest.fixture
 def sample_pdf_content():
     """Create a sample PDF-like content for testing."""
@@ -93,22 +89,18 @@ class TestProcessPDFEndpoint:
         assert response.status_code == 400
         assert "Content hash not provided" in response.get_json()["error"]
 
-    @patch("app.supabase")
     @patch("app.process_pdf")
     @patch("app.llm_client.generate_notes_for_chunks")
     def test_process_pdf_success_new_notes(
         self,
         mock_generate_notes,
         mock_process_pdf,
-        mock_supabase,
+        fake_supabase,
         client,
         headers,
         sample_pdf_content,
     ):
         """Test successful PDF processing with new notes generation."""
-        # Mock the database check for existing notes
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         # Mock PDF processing
         mock_process_pdf.return_value = (
             "extracted text",
@@ -119,9 +111,6 @@ class TestProcessPDFEndpoint:
         # Mock notes generation
         mock_generate_notes.return_value = ["note1", "note2"]
 
-        # Mock database insertion
-        mock_supabase.table().insert().execute.return_value = MagicMock()
-
         data = {
             "file": (io.BytesIO(sample_pdf_content), "test.pdf"),
             "subject": "Test Subject",
@@ -134,10 +123,10 @@ class TestProcessPDFEndpoint:
         assert result["status"] == "success"
         assert "Generated new notes" in result["message"]
         assert "content" in result
+        assert len(fake_supabase.inserted["study_notes"]) == 1
 
-    @patch("app.supabase")
     def test_process_pdf_existing_notes(
-        self, mock_supabase, client, headers, sample_pdf_content
+        self, fake_supabase, client, headers, sample_pdf_content
     ):
         """Test PDF processing when notes already exist."""
         # Mock existing notes in database
@@ -146,7 +135,7 @@ class TestProcessPDFEndpoint:
             "model_used": "test-model",
             "generated_at": "2023-01-01T00:00:00",
         }
-        mock_supabase.table().select().eq().execute.return_value.data = [existing_note]
+        fake_supabase.tables["study_notes"] = [existing_note]
 
         data = {
             "file": (io.BytesIO(sample_pdf_content), "test.pdf"),
@@ -162,18 +151,259 @@ class TestProcessPDFEndpoint:
         assert result["content"] == existing_note["content"]
 
 
+class _ImmediateExecutor:
+    """Executor stand-in that runs jobs synchronously on submit."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class TestProcessPDFAsyncEndpoint:
+    """Test the /api/process-pdf-async and /api/jobs/<job_id> endpoints."""
+
+    @pytest.fixture(autouse=True)
+    def immediate_executor(self, monkeypatch):
+        monkeypatch.setattr("app.pdf_executor", _ImmediateExecutor())
+
+    def _submit(self, client, headers, sample_pdf_content):
+        data = {
+            "file": (io.BytesIO(sample_pdf_content), "test.pdf"),
+            "subject": "Test Subject",
+            "content_hash": "test-hash",
+        }
+        return client.post("/api/process-pdf-async", data=data, headers=headers)
+
+    @patch("app.process_pdf")
+    @patch("app.llm_client.generate_notes_for_chunks")
+    def test_process_pdf_async_success(
+        self,
+        mock_generate_notes,
+        mock_process_pdf,
+        fake_supabase,
+        client,
+        headers,
+        sample_pdf_content,
+    ):
+        """Test that a queued job returns 202 and its result can be polled once."""
+        mock_process_pdf.return_value = ("extracted text", ["chunk1"], "test-hash")
+        mock_generate_notes.return_value = ["note1"]
+
+        response = self._submit(client, headers, sample_pdf_content)
+
+        assert response.status_code == 202
+        job_id = response.get_json()["job_id"]
+
+        job_response = client.get(f"/api/jobs/{job_id}", headers=headers)
+        assert job_response.status_code == 200
+        result = job_response.get_json()
+        assert result["status"] == "success"
+        assert "Generated new notes" in result["message"]
+        assert len(fake_supabase.inserted["study_notes"]) == 1
+
+        # Finished jobs are only handed out once
+        assert client.get(f"/api/jobs/{job_id}", headers=headers).status_code == 404
+
+    @patch("app.process_pdf")
+    def test_process_pdf_async_failure(
+        self, mock_process_pdf, fake_supabase, client, headers, sample_pdf_content
+    ):
+        """Test that a failed job reports its error."""
+        mock_process_pdf.side_effect = Exception("PDF processing failed")
+
+        job_id = self._submit(client, headers, sample_pdf_content).get_json()["job_id"]
+        response = client.get(f"/api/jobs/{job_id}", headers=headers)
+
+        assert response.status_code == 500
+        result = response.get_json()
+        assert result["status"] == "error"
+        assert "PDF processing failed" in result["error"]
+
+    def test_process_pdf_async_no_user_id(self, client, sample_pdf_content):
+        """Test queuing a PDF without user ID should return 401."""
+        response = self._submit(client, {}, sample_pdf_content)
+        assert response.status_code == 401
+
+    def test_get_unknown_job(self, client, headers):
+        """Test polling a job that does not exist."""
+        response = client.get("/api/jobs/nonexistent", headers=headers)
+        assert response.status_code == 404
+        assert "Job not found" in response.get_json()["error"]
+
+    @patch("app.process_pdf")
+    def test_get_job_requires_owner(
+        self, mock_process_pdf, fake_supabase, client, headers, sample_pdf_content
+    ):
+        """Test a job can only be polled by the user who queued it."""
+        mock_process_pdf.side_effect = Exception("PDF processing failed")
+        job_id = self._submit(client, headers, sample_pdf_content).get_json()["job_id"]
+
+        assert client.get(f"/api/jobs/{job_id}").status_code == 401
+        other_user = {"X-User-ID": "someone-else"}
+        assert client.get(f"/api/jobs/{job_id}", headers=other_user).status_code == 404
+        # The owner can still collect it
+        assert client.get(f"/api/jobs/{job_id}", headers=headers).status_code == 500
+
+    @patch("app.process_pdf")
+    def test_unpolled_finished_job_expires(
+        self,
+        mock_process_pdf,
+        fake_supabase,
+        client,
+        headers,
+        sample_pdf_content,
+        monkeypatch,
+    ):
+        """Test finished jobs nobody polls are dropped after PDF_JOB_TTL."""
+        mock_process_pdf.side_effect = Exception("PDF processing failed")
+        job_id = self._submit(client, headers, sample_pdf_content).get_json()["job_id"]
+
+        monkeypatch.setattr("app.PDF_JOB_TTL", -1)
+
+        assert client.get(f"/api/jobs/{job_id}", headers=headers).status_code == 404
+
+
+def _sse_events(response):
+    """Decode the JSON payloads of a text/event-stream response."""
+    return [
+        orjson.loads(line[len("data: ") :])
+        for line in response.get_data(as_text=True).splitlines()
+        if line.startswith("data: ")
+    ]
+
+
+class TestProcessPDFStreamEndpoint:
+    """Test the /api/process-pdf-stream endpoint."""
+
+    def _submit(self, client, headers, sample_pdf_content):
+        data = {
+            "file": (io.BytesIO(sample_pdf_content), "test.pdf"),
+            "subject": "Test Subject",
+            "content_hash": "test-hash",
+        }
+        return client.post("/api/process-pdf-stream", data=data, headers=headers)
+
+    @patch("app.process_pdf")
+    @patch("app.llm_client.stream_study_notes")
+    def test_stream_new_notes(
+        self,
+        mock_stream,
+        mock_process_pdf,
+        fake_supabase,
+        client,
+        headers,
+        sample_pdf_content,
+    ):
+        """Test deltas are streamed and their concatenation is what gets stored."""
+        mock_process_pdf.return_value = ("text", ["chunk1", "chunk2"], "test-hash")
+        mock_stream.side_effect = lambda chunk: iter([f"# {chunk}", " notes"])
+
+        response = self._submit(client, headers, sample_pdf_content)
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        events = _sse_events(response)
+        deltas = "".join(e["content"] for e in events if e["type"] == "delta")
+        done = events[-1]
+        assert done["type"] == "done"
+        assert done["message"] == "Generated new notes"
+        assert done["content"] == deltas
+        assert deltas == "\n\n# chunk1 notes\n\n\n\n# chunk2 notes"
+        assert fake_supabase.inserted["study_notes"][0]["content"] == deltas
+
+    def test_stream_existing_notes(
+        self, fake_supabase, client, headers, sample_pdf_content
+    ):
+        """Test stored notes are sent as a single done event."""
+        fake_supabase.tables["study_notes"] = [
+            {
+                "content": "Existing notes",
+                "model_used": LLMClient.MODEL,
+                "generated_at": "2024-01-01T00:00:00Z",
+            }
+        ]
+
+        events = _sse_events(self._submit(client, headers, sample_pdf_content))
+
+        assert len(events) == 1
+        assert events[0]["type"] == "done"
+        assert events[0]["content"] == "Existing notes"
+
+    @patch("app.process_pdf")
+    @patch("app.llm_client.stream_study_notes")
+    def test_stream_failure_is_not_stored(
+        self,
+        mock_stream,
+        mock_process_pdf,
+        fake_supabase,
+        client,
+        headers,
+        sample_pdf_content,
+    ):
+        """Test a chunk that yields nothing ends the stream with an error."""
+        mock_process_pdf.return_value = ("text", ["chunk1"], "test-hash")
+        mock_stream.return_value = iter([])
+
+        events = _sse_events(self._submit(client, headers, sample_pdf_content))
+
+        assert events[-1]["type"] == "error"
+        assert not fake_supabase.inserted.get("study_notes")
+
+    @patch("app.process_pdf")
+    @patch("app.llm_client.stream_study_notes")
+    def test_stream_interrupted_is_not_stored(
+        self,
+        mock_stream,
+        mock_process_pdf,
+        fake_supabase,
+        client,
+        headers,
+        sample_pdf_content,
+    ):
+        """Test a stream that breaks after a delta stores no partial notes."""
+        mock_process_pdf.return_value = ("text", ["chunk1"], "test-hash")
+
+        def interrupted(chunk):
+            yield "# Partial"
+            raise IncompleteStreamError("Notes stream interrupted")
+
+        mock_stream.side_effect = interrupted
+
+        events = _sse_events(self._submit(client, headers, sample_pdf_content))
+
+        assert events[-1]["type"] == "error"
+        assert not fake_supabase.inserted.get("study_notes")
+
+    def test_stream_no_user_id(self, client, sample_pdf_content):
+        """Test streaming without a user ID should return 401."""
+        response = self._submit(client, {}, sample_pdf_content)
+        assert response.status_code == 401
+
+
+class TestJSONProvider:
+    """Test the orjson-backed Flask JSON provider."""
+
+    def test_dumps_sorts_keys_like_flask(self):
+        """Test keys are sorted by default and kept in order when disabled."""
+        assert app.json.dumps({"b": 1, "a": 2}) == '{"a":2,"b":1}'
+        assert app.json.dumps({"b": 1, "a": 2}, sort_keys=False) == '{"b":1,"a":2}'
+
+
 class TestGetNotesEndpoint:
     """Test the /api/notes/<content_hash> endpoint."""
 
-    @patch("app.supabase")
-    def test_get_notes_success(self, mock_supabase, client):
+    def test_get_notes_success(self, fake_supabase, client):
         """Test successful notes retrieval."""
         note_data = {
             "content": "test note content",
             "model_used": "test-model",
             "generated_at": "2023-01-01T00:00:00",
         }
-        mock_supabase.table().select().eq().execute.return_value.data = [note_data]
+        fake_supabase.tables["study_notes"] = [note_data]
 
         response = client.get("/api/notes/test-hash")
         assert response.status_code == 200
@@ -181,11 +411,8 @@ class TestGetNotesEndpoint:
         assert result["status"] == "success"
         assert result["content"] == note_data["content"]
 
-    @patch("app.supabase")
-    def test_get_notes_not_found(self, mock_supabase, client):
+    def test_get_notes_not_found(self, fake_supabase, client):
         """Test notes retrieval when notes don't exist."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         response = client.get("/api/notes/nonexistent-hash")
         assert response.status_code == 404
         assert "Notes not found" in response.get_json()["error"]
@@ -228,18 +455,62 @@ class TestGenerateHashEndpoint:
         result = response.get_json()
         assert result["content_hash"] == "generated-hash"
 
+    def test_generate_hash_real_pdf(self, client, headers, sample_pdf, sample_pdf_hash):
+        """Test a real PDF upload is hashed end to end."""
+        data = {"file": (io.BytesIO(sample_pdf), "test.pdf")}
+        response = client.post("/api/generate-hash", data=data, headers=headers)
+
+        assert response.status_code == 200
+        assert response.get_json()["content_hash"] == sample_pdf_hash
+
+
+class TestGenerateHashFromBlobEndpoint:
+    """Test the /api/generate-hash-from-blob endpoint."""
+
+    @patch("app.process_pdf")
+    @patch("app.http_session.get")
+    def test_generate_hash_from_blob_success(
+        self, mock_get, mock_process_pdf, client, headers, sample_pdf_content
+    ):
+        """Test hashing a PDF downloaded through the shared HTTP session."""
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = sample_pdf_content
+        mock_process_pdf.return_value = ("text", ["chunks"], "blob-hash")
+
+        data = {"blob_url": "https://blob.example.com/test.pdf"}
+        response = client.post(
+            "/api/generate-hash-from-blob", json=data, headers=headers
+        )
+
+        assert response.status_code == 200
+        assert response.get_json()["content_hash"] == "blob-hash"
+        mock_get.assert_called_once_with("https://blob.example.com/test.pdf")
+        mock_process_pdf.assert_called_once_with(sample_pdf_content)
+
+    @patch("app.http_session.get")
+    def test_generate_hash_from_blob_download_failure(self, mock_get, client, headers):
+        """Test that a failed blob download returns 400."""
+        mock_get.return_value.status_code = 404
+
+        data = {"blob_url": "https://blob.example.com/missing.pdf"}
+        response = client.post(
+            "/api/generate-hash-from-blob", json=data, headers=headers
+        )
+
+        assert response.status_code == 400
+        assert "Failed to download file" in response.get_json()["error"]
+
 
 class TestGenerateFlashcardsEndpoint:
     """Test the /api/generate-flashcards-from-material/<content_hash> endpoint."""
 
-    @patch("app.supabase")
     @patch("app.llm_client.generate_flashcards")
     def test_generate_flashcards_success(
-        self, mock_generate_flashcards, mock_supabase, client, headers
+        self, mock_generate_flashcards, fake_supabase, client, headers
     ):
         """Test successful flashcard generation."""
-        # Mock existing study material
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Seed existing study material
+        fake_supabase.tables["study_notes"] = [
             {
                 "content": "Test content",
                 "model_used": "test-model",
@@ -247,11 +518,10 @@ class TestGenerateFlashcardsEndpoint:
             }
         ]
 
-        # Mock material info lookup
-        mock_supabase.table().select().eq().single().execute.return_value.data = {
-            "subject": "Test Subject",
-            "title": "Test Material",
-        }
+        # Seed material info lookup
+        fake_supabase.tables["study_materials"] = [
+            {"subject": "Test Subject", "title": "Test Material"}
+        ]
 
         # Mock flashcard generation
         mock_generate_flashcards.return_value = [
@@ -263,17 +533,6 @@ class TestGenerateFlashcardsEndpoint:
             }
         ]
 
-        # Mock database insertion
-        mock_supabase.table().insert().execute.return_value.data = [
-            {
-                "id": "1",
-                "front": "What is Python?",
-                "back": "A programming language",
-                "category": "Programming",
-                "difficulty": "easy",
-            }
-        ]
-
         data = {"category": "Programming"}
         response = client.post(
             "/api/generate-flashcards-from-material/test-hash",
@@ -286,12 +545,58 @@ class TestGenerateFlashcardsEndpoint:
         assert result["status"] == "success"
         assert "flashcards" in result
         assert result["total_saved"] == 1
+        assert len(fake_supabase.inserted["flashcards"]) == 1
 
-    @patch("app.supabase")
-    def test_generate_flashcards_no_material(self, mock_supabase, client, headers):
-        """Test flashcard generation when study material doesn't exist."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_flashcards_truncates_large_content(
+        self, mock_generate_flashcards, fake_supabase, client, headers
+    ):
+        """Test oversized material is trimmed to fit instead of rejected."""
+        fake_supabase.tables["study_notes"] = [
+            {
+                "content": "A" * (LLMClient.MAX_INPUT_TOKENS * 4 + 1),
+                "model_used": "test-model",
+                "generated_at": "2023-01-01",
+            }
+        ]
+        mock_generate_flashcards.return_value = [
+            {"front": "Q", "back": "A", "category": "Test", "difficulty": "easy"}
+        ]
+
+        response = client.post(
+            "/api/generate-flashcards-from-material/test-hash",
+            json={"category": "Test"},
+            headers=headers,
+        )
+
+        assert response.status_code == 200
+        sent_content = mock_generate_flashcards.call_args[0][0]
+        assert LLMClient.can_process_entire_document(len(sent_content))
+
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_flashcards_not_cached(
+        self, mock_generate_flashcards, fake_supabase, client, headers
+    ):
+        """Test each request generates a new set rather than reusing the last."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        mock_generate_flashcards.side_effect = [
+            [{"front": "Q1", "back": "A1", "category": "Test", "difficulty": "easy"}],
+            [{"front": "Q2", "back": "A2", "category": "Test", "difficulty": "easy"}],
+        ]
+
+        for _ in range(2):
+            client.post(
+                "/api/generate-flashcards-from-material/test-hash",
+                json={"category": "Test"},
+                headers=headers,
+            )
+
+        assert mock_generate_flashcards.call_count == 2
+        fronts = [card["front"] for card in fake_supabase.inserted["flashcards"]]
+        assert fronts == ["Q1", "Q2"]
 
+    def test_generate_flashcards_no_material(self, fake_supabase, client, headers):
+        """Test flashcard generation when study material doesn't exist."""
         data = {"category": "Test Category"}
         response = client.post(
             "/api/generate-flashcards-from-material/nonexistent-hash",
@@ -309,15 +614,12 @@ class TestGenerateFlashcardsEndpoint:
         assert response.status_code == 401
         assert "User ID not provided" in response.get_json()["error"]
 
-    @patch("app.supabase")
     @patch("app.llm_client.generate_flashcards")
     def test_generate_flashcards_llm_failure(
-        self, mock_generate_flashcards, mock_supabase, client, headers
+        self, mock_generate_flashcards, fake_supabase, client, headers
     ):
         """Test flashcard generation when LLM fails."""
-        mock_supabase.table().select().eq().execute.return_value.data = [
-            {"content": "Test content"}
-        ]
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
         mock_generate_flashcards.return_value = None
 
         data = {"category": "Test Category"}
@@ -334,17 +636,14 @@ class TestGenerateFlashcardsEndpoint:
 class TestGenerateQuizEndpoint:
     """Test the /generate-quiz endpoint."""
 
-    @patch("app.supabase")
     @patch("app.llm_client.generate_quiz")
-    def test_generate_quiz_success(self, mock_generate_quiz, mock_supabase, client):
+    def test_generate_quiz_success(self, mock_generate_quiz, fake_supabase, client):
         """Test successful quiz generation."""
-        # Mock study notes lookup
-        mock_supabase.table().select().eq().execute.return_value.data = [
-            {"content": "Test study content"}
-        ]
+        # Seed study notes lookup
+        fake_supabase.tables["study_notes"] = [{"content": "Test study content"}]
 
-        # Mock material access check
-        mock_supabase.table().select().eq().eq().execute.return_value.data = [
+        # Seed material access check
+        fake_supabase.tables["study_materials"] = [
             {"id": "1", "name": "Test Material", "user_id": "test-user"}
         ]
 
@@ -389,11 +688,8 @@ class TestGenerateQuizEndpoint:
         assert response.status_code == 400
         assert "Missing required fields" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_generate_quiz_no_content(self, mock_supabase, client):
+    def test_generate_quiz_no_content(self, fake_supabase, client):
         """Test quiz generation when no study content exists."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         data = {
             "content_hash": "nonexistent-hash",
             "material_title": "Test",
@@ -407,16 +703,11 @@ class TestGenerateQuizEndpoint:
         assert response.status_code == 404
         assert "No processed content found" in response.get_json()["error"]
 
-    @patch("app.supabase")
     @patch("app.llm_client.generate_quiz")
-    def test_generate_quiz_llm_failure(self, mock_generate_quiz, mock_supabase, client):
+    def test_generate_quiz_llm_failure(self, mock_generate_quiz, fake_supabase, client):
         """Test quiz generation when LLM fails."""
-        mock_supabase.table().select().eq().execute.return_value.data = [
-            {"content": "Test content"}
-        ]
-        mock_supabase.table().select().eq().eq().execute.return_value.data = [
-            {"id": "1", "user_id": "test-user"}
-        ]
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        fake_supabase.tables["study_materials"] = [{"id": "1", "user_id": "test-user"}]
         mock_generate_quiz.return_value = None
 
         data = {
@@ -436,20 +727,15 @@ class TestGenerateQuizEndpoint:
 class TestAskQuestionEndpoint:
     """Test the /api/ask-question endpoint."""
 
-    @patch("app.supabase")
     @patch("app.llm_client.answer_question")
-    def test_ask_question_success(self, mock_answer_question, mock_supabase, client):
+    def test_ask_question_success(self, mock_answer_question, fake_supabase, client):
         """Test successful question answering."""
-        # Mock study notes lookup - need to handle multiple calls to table().select().eq().execute()
-        notes_data = [{"id": "note-1", "content": "Python is a programming language"}]
-        material_data = [
-            {"id": "material-1", "user_id": "test-user", "name": "Python Notes"}
+        # Seed the study note and the material it belongs to
+        fake_supabase.tables["study_notes"] = [
+            {"id": "note-1", "content": "Python is a programming language"}
         ]
-
-        # Configure the mock to return different data for different calls
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(data=notes_data),  # First call for study notes
-            MagicMock(data=material_data),  # Second call for material lookup
+        fake_supabase.tables["study_materials"] = [
+            {"id": "material-1", "user_id": "test-user", "name": "Python Notes"}
         ]
 
         # Mock LLM response
@@ -457,15 +743,6 @@ class TestAskQuestionEndpoint:
             "**Summary:** Python is a high-level programming language."
         )
 
-        # Mock Q&A insertion
-        mock_supabase.table().insert().execute.return_value.data = [
-            {
-                "id": "qa-1",
-                "question": "What is Python?",
-                "answer": "Python is a programming language",
-            }
-        ]
-
         data = {"content_hash": "test-hash", "question": "What is Python?"}
 
         response = client.post("/api/ask-question", json=data)
@@ -474,6 +751,76 @@ class TestAskQuestionEndpoint:
         result = response.get_json()
         assert result["status"] == "success"
         assert "Python is a high-level programming language" in result["answer"]
+        assert len(fake_supabase.inserted["qa_sessions"]) == 1
+
+    @patch("app.llm_client.answer_question")
+    def test_ask_question_reuses_cached_answer(
+        self, mock_answer_question, fake_supabase, client
+    ):
+        """Test that repeating a question is served from the response cache."""
+        fake_supabase.tables["study_notes"] = [
+            {"id": "note-1", "content": "Python is a programming language"}
+        ]
+        mock_answer_question.return_value = "Python is a language."
+
+        data = {"content_hash": "test-hash", "question": "What is Python?"}
+        first = client.post("/api/ask-question", json=data)
+        second = client.post("/api/ask-question", json=data)
+
+        assert first.get_json()["answer"] == second.get_json()["answer"]
+        mock_answer_question.assert_called_once()
+
+    @patch("app.llm_client.answer_question")
+    def test_ask_question_regenerate_bypasses_cache(
+        self, mock_answer_question, fake_supabase, client
+    ):
+        """Test that "regenerate" asks the LLM again and replaces the cached answer."""
+        fake_supabase.tables["study_notes"] = [
+            {"id": "note-1", "content": "Python is a programming language"}
+        ]
+        mock_answer_question.side_effect = ["First answer.", "Second answer."]
+
+        data = {"content_hash": "test-hash", "question": "What is Python?"}
+        client.post("/api/ask-question", json=data)
+        regenerated = client.post(
+            "/api/ask-question", json={**data, "regenerate": True}
+        )
+        cached = client.post("/api/ask-question", json=data)
+
+        assert regenerated.get_json()["answer"] == "Second answer."
+        assert cached.get_json()["answer"] == "Second answer."
+        assert mock_answer_question.call_count == 2
+
+    @patch("app.llm_client.answer_question")
+    def test_ask_question_does_not_cache_failures(
+        self, mock_answer_question, fake_supabase, client
+    ):
+        """Test that a failed answer is retried on the next request."""
+        fake_supabase.tables["study_notes"] = [
+            {"id": "note-1", "content": "Python is a programming language"}
+        ]
+        mock_answer_question.side_effect = [None, "Python is a language."]
+
+        data = {"content_hash": "test-hash", "question": "What is Python?"}
+        assert client.post("/api/ask-question", json=data).status_code == 500
+        assert client.post("/api/ask-question", json=data).status_code == 200
+        assert mock_answer_question.call_count == 2
+
+    @patch("app.llm_client.answer_question")
+    def test_ask_question_content_too_large(
+        self, mock_answer_question, fake_supabase, client
+    ):
+        """Test that oversized notes are rejected before calling the LLM."""
+        fake_supabase.tables["study_notes"] = [
+            {"id": "note-1", "content": "A" * (LLMClient.MAX_INPUT_TOKENS * 4 + 1)}
+        ]
+
+        data = {"content_hash": "test-hash", "question": "What is this?"}
+        response = client.post("/api/ask-question", json=data)
+
+        assert response.status_code == 413
+        assert "too large" in response.get_json()["error"]
+        mock_answer_question.assert_not_called()
 
     def test_ask_question_missing_data(self, client):
         """Test question answering with missing data."""
@@ -491,11 +838,8 @@ class TestAskQuestionEndpoint:
         assert response.status_code == 400
         assert "content_hash and question are required" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_ask_question_no_notes(self, mock_supabase, client):
+    def test_ask_question_no_notes(self, fake_supabase, client):
         """Test question answering when notes don't exist."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         data = {"content_hash": "nonexistent-hash", "question": "What is Python?"}
 
         response = client.post("/api/ask-question", json=data)
@@ -503,13 +847,12 @@ class TestAskQuestionEndpoint:
         assert response.status_code == 404
         assert "Study note not found" in response.get_json()["error"]
 
-    @patch("app.supabase")
     @patch("app.llm_client.answer_question")
     def test_ask_question_llm_failure(
-        self, mock_answer_question, mock_supabase, client
+        self, mock_answer_question, fake_supabase, client
     ):
         """Test question answering when LLM fails."""
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        fake_supabase.tables["study_notes"] = [
             {"id": "note-1", "content": "Test content"}
         ]
         mock_answer_question.return_value = None
@@ -522,19 +865,212 @@ class TestAskQuestionEndpoint:
         assert "Failed to generate answer from LLM" in response.get_json()["error"]
 
 
+class TestGenerateAllEndpoint:
+    """Test the /api/generate-all/<content_hash> endpoint."""
+
+    @patch("app.llm_client.answer_question")
+    @patch("app.llm_client.generate_quiz")
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_all_success(
+        self,
+        mock_generate_flashcards,
+        mock_generate_quiz,
+        mock_answer_question,
+        fake_supabase,
+        client,
+        headers,
+    ):
+        """Test that all features are generated from one notes lookup."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        mock_generate_flashcards.return_value = [{"front": "Q", "back": "A"}]
+        mock_generate_quiz.return_value = [{"question": "Q?", "correct_answer": 0}]
+        mock_answer_question.return_value = "An answer"
+
+        data = {"category": "Programming", "question": "What is Python?"}
+        response = client.post(
+            "/api/generate-all/test-hash", json=data, headers=headers
+        )
+
+        assert response.status_code == 200
+        result = response.get_json()
+        assert result["status"] == "success"
+        assert result["errors"] == {}
+        assert len(result["flashcards"]) == 1
+        assert len(result["questions"]) == 1
+        assert result["quiz_id"]
+        assert result["answer"] == "An answer"
+        mock_generate_flashcards.assert_called_once_with("Test content", "Programming")
+        # No material listed, so the quiz falls back to the category
+        mock_generate_quiz.assert_called_once_with(
+            "Test content", "Programming", "Programming"
+        )
+        mock_answer_question.assert_called_once_with("Test content", "What is Python?")
+        # Saved for the user like the single-feature endpoints
+        assert (
+            fake_supabase.inserted["flashcards"][0]["user_id"] == headers["X-User-ID"]
+        )
+        assert fake_supabase.inserted["qa_sessions"][0]["answer"] == "An answer"
+
+    @patch("app.llm_client.answer_question")
+    @patch("app.llm_client.generate_quiz")
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_all_without_question(
+        self,
+        mock_generate_flashcards,
+        mock_generate_quiz,
+        mock_answer_question,
+        fake_supabase,
+        client,
+        headers,
+    ):
+        """Test that no answer is generated when no question is asked."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        mock_generate_flashcards.return_value = [{"front": "Q", "back": "A"}]
+        mock_generate_quiz.return_value = [{"question": "Q?", "correct_answer": 0}]
+
+        response = client.post("/api/generate-all/test-hash", json={}, headers=headers)
+
+        assert response.status_code == 200
+        result = response.get_json()
+        assert result["answer"] is None
+        assert "answer" not in result["errors"]
+        mock_answer_question.assert_not_called()
+        # Same default category as /api/generate-flashcards-from-material
+        mock_generate_flashcards.assert_called_once_with(
+            "Test content", app_module.DEFAULT_FLASHCARD_CATEGORY
+        )
+
+    @patch("app.llm_client.generate_quiz")
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_all_uses_material_subject_and_title(
+        self,
+        mock_generate_flashcards,
+        mock_generate_quiz,
+        fake_supabase,
+        client,
+        headers,
+    ):
+        """Test the quiz is built from the listed material, not the category."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        fake_supabase.tables["study_materials"] = [
+            {"subject": "Biology", "title": "Cells.pdf"}
+        ]
+        mock_generate_flashcards.return_value = [{"front": "Q", "back": "A"}]
+        mock_generate_quiz.return_value = [{"question": "Q?", "correct_answer": 0}]
+
+        response = client.post("/api/generate-all/test-hash", json={}, headers=headers)
+
+        assert response.status_code == 200
+        mock_generate_quiz.assert_called_once_with(
+            "Test content", "Biology", "Cells.pdf"
+        )
+
+    @patch("app._save_qa_session")
+    @patch("app.llm_client.answer_question")
+    @patch("app.llm_client.generate_quiz")
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_all_reports_qa_save_failure(
+        self,
+        mock_generate_flashcards,
+        mock_generate_quiz,
+        mock_answer_question,
+        mock_save_qa_session,
+        fake_supabase,
+        client,
+        headers,
+    ):
+        """Test an answer that could not be saved is reported, not returned."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        mock_generate_flashcards.return_value = [{"front": "Q", "back": "A"}]
+        mock_generate_quiz.return_value = [{"question": "Q?", "correct_answer": 0}]
+        mock_answer_question.return_value = "An answer"
+        mock_save_qa_session.side_effect = Exception("insert failed")
+
+        response = client.post(
+            "/api/generate-all/test-hash",
+            json={"question": "What is Python?"},
+            headers=headers,
+        )
+
+        assert response.status_code == 207
+        result = response.get_json()
+        assert result["answer"] is None
+        assert set(result["errors"]) == {"answer"}
+
+    @patch("app.llm_client.generate_quiz")
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_all_partial_failure(
+        self,
+        mock_generate_flashcards,
+        mock_generate_quiz,
+        fake_supabase,
+        client,
+        headers,
+    ):
+        """Test a failed feature is reported instead of looking like an empty result."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        mock_generate_flashcards.return_value = [{"front": "Q", "back": "A"}]
+        mock_generate_quiz.return_value = None
+
+        response = client.post("/api/generate-all/test-hash", json={}, headers=headers)
+
+        assert response.status_code == 207
+        result = response.get_json()
+        assert result["status"] == "partial"
+        assert result["questions"] == []
+        assert set(result["errors"]) == {"questions"}
+        assert len(result["flashcards"]) == 1
+
+    @patch("app.llm_client.generate_quiz")
+    @patch("app.llm_client.generate_flashcards")
+    def test_generate_all_total_failure(
+        self,
+        mock_generate_flashcards,
+        mock_generate_quiz,
+        fake_supabase,
+        client,
+        headers,
+    ):
+        """Test the request fails with 502 when every feature failed."""
+        fake_supabase.tables["study_notes"] = [{"content": "Test content"}]
+        mock_generate_flashcards.return_value = None
+        mock_generate_quiz.return_value = None
+
+        response = client.post("/api/generate-all/test-hash", json={}, headers=headers)
+
+        assert response.status_code == 502
+        assert set(response.get_json()["errors"]) == {"flashcards", "questions"}
+
+    def test_generate_all_no_material(self, fake_supabase, client, headers):
+        """Test generate-all when study material doesn't exist."""
+        response = client.post(
+            "/api/generate-all/nonexistent-hash", json={}, headers=headers
+        )
+
+        assert response.status_code == 404
+        assert "Study material not found" in response.get_json()["error"]
+
+    def test_generate_all_no_user_id(self, client):
+        """Test generate-all without user ID."""
+        response = client.post("/api/generate-all/test-hash", json={})
+
+        assert response.status_code == 401
+        assert "User ID not provided" in response.get_json()["error"]
+
+
 class TestQAListEndpoint:
     """Test the /api/qa-list endpoint."""
 
-    @patch("app.supabase")
-    def test_qa_list_success(self, mock_supabase, client):
+    def test_qa_list_success(self, fake_supabase, client):
         """Test successful Q&A list retrieval."""
-        # Mock material lookup
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Seed material and note lookups
+        fake_supabase.tables["study_materials"] = [
             {"id": "material-1", "name": "Test Material", "user_id": "test-user"}
         ]
+        fake_supabase.tables["study_notes"] = [{"id": "note-1"}]
 
-        # Mock Q&A sessions lookup
-        mock_supabase.table().select().eq().order().execute.return_value.data = [
+        # Seed Q&A sessions lookup
+        fake_supabase.tables["qa_sessions"] = [
             {
                 "id": "qa-1",
                 "question": "What is Python?",
@@ -543,20 +1079,6 @@ class TestQAListEndpoint:
             }
         ]
 
-        # Mock note lookup (second call)
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(
-                data=[
-                    {
-                        "id": "material-1",
-                        "name": "Test Material",
-                        "user_id": "test-user",
-                    }
-                ]
-            ),
-            MagicMock(data=[{"id": "note-1"}]),
-        ]
-
         response = client.get("/api/qa-list?content_hash=test-hash")
 
         assert response.status_code == 200
@@ -572,12 +1094,8 @@ class TestQAListEndpoint:
         assert response.status_code == 400
         assert "content_hash is required" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_qa_list_empty(self, mock_supabase, client):
+    def test_qa_list_empty(self, fake_supabase, client):
         """Test Q&A list retrieval with no Q&A sessions."""
-        # Mock empty material lookup
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         response = client.get("/api/qa-list?content_hash=test-hash")
 
         assert response.status_code == 200
@@ -588,11 +1106,8 @@ class TestQAListEndpoint:
 class TestDeleteQAEndpoint:
     """Test the /api/qa/<qa_id> DELETE endpoint."""
 
-    @patch("app.supabase")
-    def test_delete_qa_success(self, mock_supabase, client, headers):
+    def test_delete_qa_success(self, fake_supabase, client, headers):
         """Test successful Q&A deletion."""
-        mock_supabase.table().delete().eq().execute.return_value = MagicMock()
-
         response = client.delete("/api/qa/test-qa-id", headers=headers)
 
         assert response.status_code == 200
@@ -607,12 +1122,9 @@ class TestDeleteQAEndpoint:
         assert response.status_code == 401
         assert "User ID not provided" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_delete_qa_database_error(self, mock_supabase, client, headers):
+    def test_delete_qa_database_error(self, fake_supabase, client, headers):
         """Test Q&A deletion with database error."""
-        mock_supabase.table().delete().eq().execute.side_effect = Exception(
-            "Database error"
-        )
+        fake_supabase.error = Exception("Database error")
 
         response = client.delete("/api/qa/test-qa-id", headers=headers)
 
@@ -623,10 +1135,9 @@ class TestDeleteQAEndpoint:
 class TestDebugEndpoints:
     """Test debug endpoints."""
 
-    @patch("app.supabase")
-    def test_debug_material_exists(self, mock_supabase, client):
+    def test_debug_material_exists(self, fake_supabase, client):
         """Test debug material endpoint with existing material."""
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        fake_supabase.tables["study_materials"] = [
             {
                 "id": "test-id",
                 "name": "Test Material",
@@ -637,30 +1148,14 @@ class TestDebugEndpoints:
             }
         ]
 
-        # Mock notes lookup
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(
-                data=[
-                    {
-                        "id": "test-id",
-                        "name": "Test Material",
-                        "subject": "Programming",
-                        "user_id": "test-user",
-                        "content_hash": "test-hash",
-                        "uploaded_at": "2023-01-01",
-                    }
-                ]
-            ),
-            MagicMock(
-                data=[
-                    {
-                        "content_hash": "test-hash",
-                        "content": "Test content",
-                        "generated_at": "2023-01-01",
-                        "model_used": "test-model",
-                    }
-                ]
-            ),
+        # Seed notes lookup
+        fake_supabase.tables["study_notes"] = [
+            {
+                "content_hash": "test-hash",
+                "content": "Test content",
+                "generated_at": "2023-01-01",
+                "model_used": "test-model",
+            }
         ]
 
         response = client.get("/debug-material/test-id")
@@ -671,11 +1166,8 @@ class TestDebugEndpoints:
         assert result["material_data"]["name"] == "Test Material"
         assert result["notes_found"] is True
 
-    @patch("app.supabase")
-    def test_debug_material_not_found(self, mock_supabase, client):
+    def test_debug_material_not_found(self, fake_supabase, client):
         """Test debug material endpoint with non-existent material."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         response = client.get("/debug-material/nonexistent-id")
 
         assert response.status_code == 200
@@ -683,32 +1175,25 @@ class TestDebugEndpoints:
         assert result["material_found"] is False
         assert result["material_count"] == 0
 
-    @patch("app.supabase")
-    def test_debug_content_exists(self, mock_supabase, client):
+    def test_debug_content_exists(self, fake_supabase, client):
         """Test debug content endpoint with existing content."""
-        # Mock notes lookup
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(
-                data=[
-                    {
-                        "content_hash": "test-hash",
-                        "content": "Test content",
-                        "generated_at": "2023-01-01",
-                        "model_used": "test-model",
-                    }
-                ]
-            ),
-            MagicMock(
-                data=[
-                    {
-                        "id": "material-1",
-                        "name": "Test Material",
-                        "subject": "Programming",
-                        "user_id": "test-user",
-                        "uploaded_at": "2023-01-01",
-                    }
-                ]
-            ),
+        # Seed notes lookup
+        fake_supabase.tables["study_notes"] = [
+            {
+                "content_hash": "test-hash",
+                "content": "Test content",
+                "generated_at": "2023-01-01",
+                "model_used": "test-model",
+            }
+        ]
+        fake_supabase.tables["study_materials"] = [
+            {
+                "id": "material-1",
+                "name": "Test Material",
+                "subject": "Programming",
+                "user_id": "test-user",
+                "uploaded_at": "2023-01-01",
+            }
         ]
 
         response = client.get("/debug-content/test-hash")
@@ -725,7 +1210,7 @@ class TestErrorHandling:
 
     @patch("app.process_pdf")
     def test_process_pdf_exception(
-        self, mock_process_pdf, client, headers, sample_pdf_content
+        self, mock_process_pdf, fake_supabase, client, headers, sample_pdf_content
     ):
         """Test PDF processing when an exception occurs."""
         mock_process_pdf.side_effect = Exception("PDF processing failed")
@@ -740,23 +1225,17 @@ class TestErrorHandling:
         assert response.status_code == 500
         assert "PDF processing failed" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_get_notes_exception(self, mock_supabase, client):
+    def test_get_notes_exception(self, fake_supabase, client):
         """Test notes retrieval when database throws exception."""
-        mock_supabase.table().select().eq().execute.side_effect = Exception(
-            "Database error"
-        )
+        fake_supabase.error = Exception("Database error")
 
         response = client.get("/api/notes/test-hash")
         assert response.status_code == 500
         assert "Database error" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_generate_flashcards_database_error(self, mock_supabase, client, headers):
+    def test_generate_flashcards_database_error(self, fake_supabase, client, headers):
         """Test flashcard generation with database error."""
-        mock_supabase.table().select().eq().execute.side_effect = Exception(
-            "Database error"
-        )
+        fake_supabase.error = Exception("Database error")
 
         data = {"category": "Test Category"}
         response = client.post(
@@ -768,12 +1247,9 @@ class TestErrorHandling:
         assert response.status_code == 500
         assert "Database error" in response.get_json()["error"]
 
-    @patch("app.supabase")
-    def test_generate_quiz_database_error(self, mock_supabase, client):
+    def test_generate_quiz_database_error(self, fake_supabase, client):
         """Test quiz generation with database error."""
-        mock_supabase.table().select().eq().execute.side_effect = Exception(
-            "Database error"
-        )
+        fake_supabase.error = Exception("Database error")
 
         data = {
             "content_hash": "test-hash",
@@ -5,147 +5,207 @@ Tests end-to-end workflows and component interactions.
 
 import pytest
 import io
-import os
-from unittest.mock import patch, MagicMock
-from app import app
-import requests
-
-
-@pytest.fixture
-def client():
-    """Create a test client for integration tests."""
-    app.config["TESTING"] = True
-    with app.test_client() as client:
-        yield client
-
-
-@pytest.fixture
-def sample_pdf():
-    """Create a more realistic PDF for integration testing."""
-    return b"""%PDF-1.4
-1 0 obj
-<<
-/Type /Catalog
-/Pages 2 0 R
->>
-endobj
-2 0 obj
-<<
-/Type /Pages
-/Kids [3 0 R]
-/Count 1
->>
-endobj
-3 0 obj
-<<
-/Type /Page
-/Parent 2 0 R
-/MediaBox [0 0 612 792]
-/Contents 4 0 R
->>
-endobj
-4 0 obj
-<<
-/Length 44
->>
-stream
-BT
-/F1 12 Tf
-100 700 Td
-(Hello World) Tj
-ET
-endstream
-endobj
-xref
-0 5
-0000000000 65535 f 
-0000000010 00000 n 
-0000000079 00000 n 
-0000000173 00000 n 
-0000000301 00000 n 
-trailer
-<<
-/Size 5
-/Root 1 0 R
->>
-startxref
-380
-%%EOF"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from app import (
+    app,
+    ask_question,
+    generate_flashcards_from_material,
+    generate_quiz,
+    llm_client,
+    process_pdf_endpoint,
+)
+import orjson
+import responses
+
+OPENROUTER_URL = llm_client.api_url
+
+app.config["TESTING"] = True
+
+
+@dataclass(frozen=True)
+class StubResponse:
+    """Canned OpenRouter reply registered with the llm_api transport mock."""
+
+    status: int = 200
+    json: dict = None
+    body: object = ""
+
+    def register(self, llm_api):
+        """Make this the reply to every following OpenRouter request."""
+        if self.json is not None:
+            llm_api.upsert(
+                responses.POST, OPENROUTER_URL, status=self.status, json=self.json
+            )
+        else:
+            llm_api.upsert(
+                responses.POST, OPENROUTER_URL, status=self.status, body=self.body
+            )
 
 
-class TestCompleteWorkflow:
-    """Test complete user workflows."""
+def _completion(content):
+    """Wrap message content in an OpenRouter chat completion envelope."""
+    return {"choices": [{"message": {"content": content}}]}
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    def test_full_pdf_processing_workflow(
-        self, mock_requests_post, mock_supabase, client, sample_pdf
-    ):
-        """Test the complete workflow from PDF upload to notes generation."""
-        # Mock successful LLM API response
-        mock_llm_response = MagicMock()
-        mock_llm_response.status_code = 200
-        mock_llm_response.raise_for_status.return_value = None
-        mock_llm_response.json.return_value = {
-            "choices": [
-                {"message": {"content": "Generated study notes for the content"}}
-            ]
+
+# Payloads the mocked model returns; serialized once at import time.
+_FLASHCARDS_JSON = {
+    "flashcards": [
+        {
+            "front": "What is Python?",
+            "back": "A programming language",
+            "category": "Programming",
+            "difficulty": "easy",
         }
-        mock_requests_post.return_value = mock_llm_response
-
-        # Mock database responses
-        mock_supabase.table().select().eq().execute.return_value.data = (
-            []
-        )  # No existing notes
-        mock_supabase.table().insert().execute.return_value = MagicMock()
-
-        # Step 1: Generate hash
-        hash_data = {"file": (io.BytesIO(sample_pdf), "test.pdf")}
-        hash_response = client.post(
-            "/api/generate-hash", data=hash_data, headers={"X-User-ID": "test-user"}
-        )
+    ]
+}
+FLASHCARDS_RESP = StubResponse(
+    json=_completion(orjson.dumps(_FLASHCARDS_JSON).decode())
+)
+_QUIZ_JSON = {
+    "questions": [
+        {
+            "question": "Who created Python?",
+            "options": [
+                "Guido van Rossum",
+                "Linus Torvalds",
+                "Dennis Ritchie",
+                "James Gosling",
+            ],
+            "correct_answer": 0,
+            "explanation": "Python was created by Guido van Rossum",
+            "difficulty": "easy",
+        },
+        {
+            "question": "What is Python?",
+            "options": ["Programming Language", "Snake", "Tool", "Framework"],
+            "correct_answer": 0,
+            "explanation": "Python is a programming language",
+            "difficulty": "easy",
+        },
+        {
+            "question": "Is Python interpreted?",
+            "options": ["Yes", "No", "Sometimes", "Never"],
+            "correct_answer": 0,
+            "explanation": "Python is an interpreted language",
+            "difficulty": "easy",
+        },
+        {
+            "question": "What syntax does Python use?",
+            "options": ["Indentation", "Brackets", "Semicolons", "None"],
+            "correct_answer": 0,
+            "explanation": "Python uses indentation for code blocks",
+            "difficulty": "easy",
+        },
+        {
+            "question": "Is Python open source?",
+            "options": ["Yes", "No", "Partially", "Commercial"],
+            "correct_answer": 0,
+            "explanation": "Python is open source software",
+            "difficulty": "easy",
+        },
+    ]
+}
+QUIZ_RESP = StubResponse(json=_completion(orjson.dumps(_QUIZ_JSON).decode()))
+ANSWER_RESP = StubResponse(
+    json=_completion(
+        "**Summary:** Python was created by Guido van Rossum.\n\nPython is a high-level programming language that was first released in 1991."
+    )
+)
+RATE_LIMIT_RESP = StubResponse(status=429, body="Rate limit exceeded")
+API_ERROR_RESP = StubResponse(body=ConnectionError("API Error"))
+
+
+# (endpoint, JSON payload, headers) for each LLM-backed feature endpoint
+LLM_FEATURE_REQUESTS = [
+    pytest.param(
+        "/api/generate-flashcards-from-material/test-hash",
+        {"category": "Test Category"},
+        {"X-User-ID": "test-user"},
+        id="flashcards",
+    ),
+    pytest.param(
+        "/generate-quiz",
+        {
+            "content_hash": "test-hash",
+            "material_title": "Test",
+            "material_subject": "Test",
+            "quiz_title": "Test Quiz",
+            "user_id": "test-user",
+        },
+        None,
+        id="quiz",
+    ),
+    pytest.param(
+        "/api/ask-question",
+        {"content_hash": "test-hash", "question": "Test question?"},
+        None,
+        id="qa",
+    ),
+]
 
-        assert hash_response.status_code == 200
-        content_hash = hash_response.get_json()["content_hash"]
 
-        # Step 2: Process PDF
-        process_data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Test Subject",
-            "content_hash": content_hash,
-        }
-        process_response = client.post(
-            "/api/process-pdf", data=process_data, headers={"X-User-ID": "test-user"}
-        )
+# 5M characters, likely to exceed token limits. Built once per module; the fake
+# database hands out the same string object to every request.
+LARGE_CONTENT = "A" * 5_000_000
 
-        assert process_response.status_code == 200
-        process_result = process_response.get_json()
-        assert process_result["status"] == "success"
-        assert "content" in process_result
-
-        # Step 3: Retrieve notes
-        notes_response = client.get(f"/api/notes/{content_hash}")
-        # This will fail in test since we're mocking, but it shows the workflow
-
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    def test_existing_notes_workflow(self, mock_supabase, client, sample_pdf):
-        """Test workflow when notes already exist."""
-        # Mock existing notes in database
-        existing_note = {
-            "content": "Previously generated notes",
-            "model_used": "test-model",
-            "generated_at": "2023-01-01T00:00:00",
-        }
-        mock_supabase.table().select().eq().execute.return_value.data = [existing_note]
+# Acceptable status codes for tolerant assertions, built once at import.
+_LARGE_OK = frozenset({200, 413, 500})
+_CONCURRENT_OK = frozenset({200, 302, 400})
 
-        # Process PDF (should return existing notes)
-        data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Test Subject",
-            "content_hash": "existing-hash",
-        }
+# Notes row returned when a PDF has already been processed.
+EXISTING_NOTE = {
+    "content": "Previously generated notes",
+    "model_used": "test-model",
+    "generated_at": "2023-01-01T00:00:00",
+}
+
+
+def _pdf_form(pdf_bytes, name="test.pdf", **extra):
+    """Build multipart form data with a fresh stream over the given PDF bytes."""
+    return {"file": (io.BytesIO(pdf_bytes), name), **extra}
+
+
+def _call_view(view, path, *view_args, **request_kwargs):
+    """Call a view function directly under a request context.
+
+    Skips URL routing and the test client round trip for tests that only
+    check an early error return. Returns the parsed JSON body and status code.
+    """
+    with app.test_request_context(path, method="POST", **request_kwargs):
+        response, status_code = view(*view_args)
+        return response.get_json(), status_code
+
+
+@pytest.fixture(scope="session")
+def large_pdf():
+    """Return a PDF payload just over the 4 KB limit used by size tests."""
+    return b"%PDF-1.4\n" + b"A" * (5 * 1024)
+
+
+@pytest.mark.integration
+@pytest.mark.xdist_group("requires_app_patches")
+@pytest.mark.usefixtures("patched_services")
+class TestCompleteWorkflow:
+    """Test complete user workflows."""
+
+    @pytest.fixture(params=["fresh", "cached"])
+    def notes_state(self, request, fake_supabase):
+        """Seed the database with no notes ("fresh") or existing notes ("cached")."""
+        if request.param == "fresh":
+            request.getfixturevalue("mock_llm_success")
+        else:
+            fake_supabase.tables["study_notes"] = [EXISTING_NOTE]
+        return request.param
+
+    def test_pdf_processing_workflow(
+        self, notes_state, llm_api, fake_supabase, client, sample_pdf, sample_pdf_hash
+    ):
+        """Test PDF upload with and without previously generated notes."""
+        data = _pdf_form(
+            sample_pdf, subject="Test Subject", content_hash=sample_pdf_hash
+        )
         response = client.post(
             "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
         )
@@ -153,81 +213,58 @@ class TestCompleteWorkflow:
         assert response.status_code == 200
         result = response.get_json()
         assert result["status"] == "success"
-        assert "Retrieved existing notes" in result["message"]
-        assert result["content"] == existing_note["content"]
+        if notes_state == "cached":
+            assert "Retrieved existing notes" in result["message"]
+            assert result["content"] == EXISTING_NOTE["content"]
+            # The cached path must never reach the LLM
+            assert len(llm_api.calls) == 0
+        else:
+            assert "Generated new notes" in result["message"]
+            assert len(fake_supabase.inserted["study_notes"]) == 1
+
+    def test_generate_hash_matches_fixture(self, client, sample_pdf, sample_pdf_hash):
+        """Test that the hash endpoint agrees with the precomputed fixture."""
+        response = client.post(
+            "/api/generate-hash",
+            data=_pdf_form(sample_pdf),
+            headers={"X-User-ID": "test-user"},
+        )
+
+        assert response.status_code == 200
+        assert response.get_json()["content_hash"] == sample_pdf_hash
 
 
+@pytest.mark.integration
+@pytest.mark.usefixtures("patched_services")
 class TestFlashcardWorkflow:
     """Test complete flashcard generation workflow."""
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
     def test_end_to_end_flashcard_generation(
-        self, mock_requests_post, mock_supabase, client, sample_pdf
+        self, mock_llm_success, llm_api, fake_supabase, client, sample_pdf
     ):
         """Test complete workflow from PDF to flashcard generation."""
-        # Step 1: Mock PDF processing and notes generation
-        mock_llm_response = MagicMock()
-        mock_llm_response.status_code = 200
-        mock_llm_response.raise_for_status.return_value = None
-        mock_llm_response.json.return_value = {
-            "choices": [
-                {"message": {"content": "Generated study notes for flashcard testing"}}
-            ]
-        }
-        mock_requests_post.return_value = mock_llm_response
-
-        # Mock database for PDF processing
-        mock_supabase.table().select().eq().execute.return_value.data = []
-        mock_supabase.table().insert().execute.return_value = MagicMock()
-
-        # Process PDF first
-        process_data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Programming",
-            "content_hash": "test-flashcard-hash",
-        }
+        # Step 1: Process PDF first (notes come from mock_llm_success)
+        process_data = _pdf_form(
+            sample_pdf, subject="Programming", content_hash="test-flashcard-hash"
+        )
         process_response = client.post(
             "/api/process-pdf", data=process_data, headers={"X-User-ID": "test-user"}
         )
         assert process_response.status_code == 200
 
         # Step 2: Mock flashcard generation
-        mock_flashcard_response = MagicMock()
-        mock_flashcard_response.status_code = 200
-        mock_flashcard_response.raise_for_status.return_value = None
-        mock_flashcard_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": '{"flashcards": [{"front": "What is Python?", "back": "A programming language", "category": "Programming", "difficulty": "easy"}]}'
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_flashcard_response
+        FLASHCARDS_RESP.register(llm_api)
 
-        # Mock database responses for flashcard generation
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Seed the database for flashcard generation
+        fake_supabase.tables["study_notes"] = [
             {
                 "content": "Python is a programming language",
                 "model_used": "test",
                 "generated_at": "2023-01-01T00:00:00",
             }
         ]
-        mock_supabase.table().select().eq().single().execute.return_value.data = {
-            "subject": "Programming",
-            "title": "Python Basics",
-        }
-        mock_supabase.table().insert().execute.return_value.data = [
-            {
-                "id": "1",
-                "front": "What is Python?",
-                "back": "A programming language",
-                "category": "Programming",
-                "difficulty": "easy",
-            }
+        fake_supabase.tables["study_materials"] = [
+            {"subject": "Programming", "title": "Python Basics"}
         ]
 
         # Step 3: Generate flashcards
@@ -243,58 +280,42 @@ class TestFlashcardWorkflow:
         assert flashcard_result["status"] == "success"
         assert "flashcards" in flashcard_result
         assert flashcard_result["total_saved"] == 1
+        assert len(fake_supabase.inserted["flashcards"]) == 1
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    def test_flashcard_generation_without_study_material(self, mock_supabase, client):
+    def test_flashcard_generation_without_study_material(self, fake_supabase):
         """Test flashcard generation when study material doesn't exist."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         flashcard_data = {"category": "Test Category"}
-        response = client.post(
+        result, status_code = _call_view(
+            generate_flashcards_from_material,
             "/api/generate-flashcards-from-material/nonexistent-hash",
+            "nonexistent-hash",
             json=flashcard_data,
             headers={"X-User-ID": "test-user"},
         )
 
-        assert response.status_code == 404
-        assert "Study material not found" in response.get_json()["error"]
+        assert status_code == 404
+        assert "Study material not found" in result["error"]
 
 
+@pytest.mark.integration
+@pytest.mark.usefixtures("patched_services")
 class TestQuizWorkflow:
     """Test complete quiz generation and taking workflow."""
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
     def test_end_to_end_quiz_generation(
-        self, mock_requests_post, mock_supabase, client, sample_pdf
+        self, llm_api, fake_supabase, client, sample_pdf
     ):
         """Test complete workflow from PDF to quiz generation."""
-        # Step 1: Mock study content exists
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Step 1: Seed study content and the material access check
+        fake_supabase.tables["study_notes"] = [
             {"content": "Python is a programming language created by Guido van Rossum"}
         ]
-
-        # Mock material access check
-        mock_supabase.table().select().eq().eq().execute.return_value.data = [
+        fake_supabase.tables["study_materials"] = [
             {"id": "1", "name": "Python Basics", "user_id": "test-user"}
         ]
 
         # Step 2: Mock quiz generation
-        mock_quiz_response = MagicMock()
-        mock_quiz_response.status_code = 200
-        mock_quiz_response.raise_for_status.return_value = None
-        mock_quiz_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": '{"questions": [{"question": "Who created Python?", "options": ["Guido van Rossum", "Linus Torvalds", "Dennis Ritchie", "James Gosling"], "correct_answer": 0, "explanation": "Python was created by Guido van Rossum", "difficulty": "easy"}, {"question": "What is Python?", "options": ["Programming Language", "Snake", "Tool", "Framework"], "correct_answer": 0, "explanation": "Python is a programming language", "difficulty": "easy"}, {"question": "Is Python interpreted?", "options": ["Yes", "No", "Sometimes", "Never"], "correct_answer": 0, "explanation": "Python is an interpreted language", "difficulty": "easy"}, {"question": "What syntax does Python use?", "options": ["Indentation", "Brackets", "Semicolons", "None"], "correct_answer": 0, "explanation": "Python uses indentation for code blocks", "difficulty": "easy"}, {"question": "Is Python open source?", "options": ["Yes", "No", "Partially", "Commercial"], "correct_answer": 0, "explanation": "Python is open source software", "difficulty": "easy"}]}'
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_quiz_response
+        QUIZ_RESP.register(llm_api)
 
         # Step 3: Generate quiz
         quiz_data = {
@@ -313,12 +334,8 @@ class TestQuizWorkflow:
         assert "quiz_id" in quiz_result
         assert "questions" in quiz_result
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    def test_quiz_generation_without_content(self, mock_supabase, client):
+    def test_quiz_generation_without_content(self, fake_supabase):
         """Test quiz generation when no study content exists."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         quiz_data = {
             "content_hash": "nonexistent-hash",
             "material_title": "Test",
@@ -327,61 +344,34 @@ class TestQuizWorkflow:
             "user_id": "test-user",
         }
 
-        response = client.post("/generate-quiz", json=quiz_data)
+        result, status_code = _call_view(
+            generate_quiz, "/generate-quiz", json=quiz_data
+        )
 
-        assert response.status_code == 404
-        assert "No processed content found" in response.get_json()["error"]
+        assert status_code == 404
+        assert "No processed content found" in result["error"]
 
 
+@pytest.mark.integration
+@pytest.mark.usefixtures("patched_services")
 class TestQAWorkflow:
     """Test complete question-answering workflow."""
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    def test_end_to_end_qa_workflow(self, mock_requests_post, mock_supabase, client):
+    def test_end_to_end_qa_workflow(self, llm_api, fake_supabase, client):
         """Test complete Q&A workflow from question to answer storage."""
-        # Step 1: Mock study notes exist
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Step 1: Seed study notes and the owning material
+        fake_supabase.tables["study_notes"] = [
             {
                 "id": "note-1",
                 "content": "Python is a high-level programming language created by Guido van Rossum",
             }
         ]
-
-        # Mock material lookup
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(data=[{"id": "note-1", "content": "Python content"}]),
-            MagicMock(
-                data=[
-                    {"id": "material-1", "user_id": "test-user", "name": "Python Notes"}
-                ]
-            ),
+        fake_supabase.tables["study_materials"] = [
+            {"id": "material-1", "user_id": "test-user", "name": "Python Notes"}
         ]
 
         # Step 2: Mock LLM answer generation
-        mock_answer_response = MagicMock()
-        mock_answer_response.status_code = 200
-        mock_answer_response.raise_for_status.return_value = None
-        mock_answer_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": "**Summary:** Python was created by Guido van Rossum.\n\nPython is a high-level programming language that was first released in 1991."
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_answer_response
-
-        # Mock Q&A insertion
-        mock_supabase.table().insert().execute.return_value.data = [
-            {
-                "id": "qa-1",
-                "question": "Who created Python?",
-                "answer": "Python was created by Guido van Rossum",
-            }
-        ]
+        ANSWER_RESP.register(llm_api)
 
         # Step 3: Ask question
         qa_data = {"content_hash": "test-qa-hash", "question": "Who created Python?"}
@@ -392,18 +382,10 @@ class TestQAWorkflow:
         qa_result = qa_response.get_json()
         assert qa_result["status"] == "success"
         assert "Guido van Rossum" in qa_result["answer"]
+        assert len(fake_supabase.inserted["qa_sessions"]) == 1
 
         # Step 4: Test Q&A list retrieval
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(
-                data=[
-                    {"id": "material-1", "name": "Python Notes", "user_id": "test-user"}
-                ]
-            ),
-            MagicMock(data=[{"id": "note-1"}]),
-        ]
-
-        mock_supabase.table().select().eq().order().execute.return_value.data = [
+        fake_supabase.tables["qa_sessions"] = [
             {
                 "id": "qa-1",
                 "question": "Who created Python?",
@@ -420,8 +402,6 @@ class TestQAWorkflow:
         assert qa_list_result["qa"][0]["question"] == "Who created Python?"
 
         # Step 5: Test Q&A deletion
-        mock_supabase.table().delete().eq().execute.return_value = MagicMock()
-
         delete_response = client.delete(
             "/api/qa/qa-1", headers={"X-User-ID": "test-user"}
         )
@@ -429,117 +409,81 @@ class TestQAWorkflow:
         assert delete_response.status_code == 200
         assert "deleted" in delete_response.get_json()["message"]
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    def test_qa_without_study_notes(self, mock_supabase, client):
+    def test_qa_without_study_notes(self, fake_supabase):
         """Test Q&A when study notes don't exist."""
-        mock_supabase.table().select().eq().execute.return_value.data = []
-
         qa_data = {"content_hash": "nonexistent-hash", "question": "Test question?"}
 
-        response = client.post("/api/ask-question", json=qa_data)
+        result, status_code = _call_view(
+            ask_question, "/api/ask-question", json=qa_data
+        )
 
-        assert response.status_code == 404
-        assert "Study note not found" in response.get_json()["error"]
+        assert status_code == 404
+        assert "Study note not found" in result["error"]
 
 
+@pytest.mark.integration
+@pytest.mark.usefixtures("patched_services")
 class TestCrossFeatureIntegration:
     """Test integration between different features."""
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    def test_pdf_to_all_features_workflow(
-        self, mock_requests_post, mock_supabase, client, sample_pdf
-    ):
-        """Test using one PDF to generate notes, flashcards, quiz, and Q&A."""
-        content_hash = "integration-test-hash"
-
-        # Step 1: Process PDF
-        mock_llm_response = MagicMock()
-        mock_llm_response.status_code = 200
-        mock_llm_response.raise_for_status.return_value = None
-        mock_llm_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": "Comprehensive study notes about Python programming"
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_llm_response
-        mock_supabase.table().select().eq().execute.return_value.data = []
-        mock_supabase.table().insert().execute.return_value = MagicMock()
-
-        process_data = {
-            "file": (io.BytesIO(sample_pdf), "python_guide.pdf"),
-            "subject": "Programming",
-            "content_hash": content_hash,
-        }
-        process_response = client.post(
-            "/api/process-pdf", data=process_data, headers={"X-User-ID": "test-user"}
-        )
-        assert process_response.status_code == 200
+    @pytest.fixture
+    def processed_hash(self, fake_supabase):
+        """Return the shared content hash with its notes and material seeded.
 
-        # Step 2: Generate flashcards from the same content
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        All database state is faked, so each step can start from the
+        "already processed" state instead of chaining through the previous one.
+        """
+        fake_supabase.tables["study_notes"] = [
             {
+                "id": "note-1",
                 "content": "Python programming notes",
                 "model_used": "test",
                 "generated_at": "2023-01-01T00:00:00",
             }
         ]
-        mock_supabase.table().select().eq().single().execute.return_value.data = {
-            "subject": "Programming",
-            "title": "Python Guide",
-        }
+        fake_supabase.tables["study_materials"] = [
+            {
+                "id": "material-1",
+                "user_id": "test-user",
+                "subject": "Programming",
+                "title": "Python Guide",
+            }
+        ]
+        return "integration-test-hash"
 
-        mock_flashcard_response = MagicMock()
-        mock_flashcard_response.status_code = 200
-        mock_flashcard_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": '{"flashcards": [{"front": "What is Python?", "back": "A programming language", "category": "Programming", "difficulty": "easy"}]}'
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_flashcard_response
-        mock_supabase.table().insert().execute.return_value.data = [{"id": "1"}]
+    def test_process_pdf_step(
+        self, mock_llm_success, fake_supabase, client, sample_pdf
+    ):
+        """Step 1: process the PDF into study notes."""
+        process_data = _pdf_form(
+            sample_pdf,
+            name="python_guide.pdf",
+            subject="Programming",
+            content_hash="integration-test-hash",
+        )
+        process_response = client.post(
+            "/api/process-pdf", data=process_data, headers={"X-User-ID": "test-user"}
+        )
+        assert process_response.status_code == 200
+
+    def test_flashcards_step(self, llm_api, client, processed_hash):
+        """Step 2: generate flashcards from the same content."""
+        FLASHCARDS_RESP.register(llm_api)
 
         flashcard_data = {"category": "Programming"}
         flashcard_response = client.post(
-            f"/api/generate-flashcards-from-material/{content_hash}",
+            f"/api/generate-flashcards-from-material/{processed_hash}",
             json=flashcard_data,
             headers={"X-User-ID": "test-user"},
         )
         assert flashcard_response.status_code == 200
 
-        # Step 3: Generate quiz from the same content
-        mock_supabase.table().select().eq().execute.return_value.data = [
-            {"content": "Python programming notes"}
-        ]
-        mock_supabase.table().select().eq().eq().execute.return_value.data = [
-            {"id": "1", "user_id": "test-user"}
-        ]
-
-        mock_quiz_response = MagicMock()
-        mock_quiz_response.status_code = 200
-        mock_quiz_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": '{"questions": [{"question": "What is Python?", "options": ["Programming Language", "Snake", "Tool", "Framework"], "correct_answer": 0, "explanation": "Python is a programming language", "difficulty": "easy"}, {"question": "Who created Python?", "options": ["Guido van Rossum", "Linus Torvalds", "Dennis Ritchie", "James Gosling"], "correct_answer": 0, "explanation": "Python was created by Guido van Rossum", "difficulty": "easy"}, {"question": "Is Python interpreted?", "options": ["Yes", "No", "Sometimes", "Never"], "correct_answer": 0, "explanation": "Python is an interpreted language", "difficulty": "easy"}, {"question": "What syntax does Python use?", "options": ["Indentation", "Brackets", "Semicolons", "None"], "correct_answer": 0, "explanation": "Python uses indentation for code blocks", "difficulty": "easy"}, {"question": "Is Python open source?", "options": ["Yes", "No", "Partially", "Commercial"], "correct_answer": 0, "explanation": "Python is open source software", "difficulty": "easy"}]}'
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_quiz_response
+    def test_quiz_step(self, llm_api, client, processed_hash):
+        """Step 3: generate a quiz from the same content."""
+        QUIZ_RESP.register(llm_api)
 
         quiz_data = {
-            "content_hash": content_hash,
+            "content_hash": processed_hash,
             "material_title": "Python Guide",
             "material_subject": "Programming",
             "quiz_title": "Python Quiz",
@@ -548,65 +492,77 @@ class TestCrossFeatureIntegration:
         quiz_response = client.post("/generate-quiz", json=quiz_data)
         assert quiz_response.status_code == 200
 
-        # Step 4: Ask questions about the same content
-        mock_supabase.table().select().eq().execute.side_effect = [
-            MagicMock(data=[{"id": "note-1", "content": "Python programming notes"}]),
-            MagicMock(data=[{"id": "material-1", "user_id": "test-user"}]),
-        ]
+    def test_generate_all_step(self, llm_api, client, processed_hash):
+        """Generate every feature from the same content in one request."""
+        # The three calls run concurrently, so reply by the requested schema
+        replies = {"flashcards": FLASHCARDS_RESP, "quiz": QUIZ_RESP}
+
+        def reply(request):
+            body = orjson.loads(request.body)
+            schema = body.get("response_format", {}).get("json_schema", {})
+            stub = replies.get(schema.get("name"), ANSWER_RESP)
+            return stub.status, {}, orjson.dumps(stub.json)
+
+        llm_api.add_callback(
+            responses.POST,
+            OPENROUTER_URL,
+            callback=reply,
+            content_type="application/json",
+        )
 
-        mock_answer_response = MagicMock()
-        mock_answer_response.status_code = 200
-        mock_answer_response.json.return_value = {
-            "choices": [{"message": {"content": "Python is a programming language"}}]
-        }
-        mock_requests_post.return_value = mock_answer_response
-        mock_supabase.table().insert().execute.return_value.data = [{"id": "qa-1"}]
+        response = client.post(
+            f"/api/generate-all/{processed_hash}",
+            json={"category": "Programming", "question": "What is Python used for?"},
+            headers={"X-User-ID": "test-user"},
+        )
 
-        qa_data = {"content_hash": content_hash, "question": "What is Python used for?"}
+        assert response.status_code == 200
+        result = response.get_json()
+        assert result["errors"] == {}
+        assert len(result["flashcards"]) == 1
+        assert len(result["questions"]) == len(_QUIZ_JSON["questions"])
+        assert "Python" in result["answer"]
+        # Flashcards, quiz and answer each make exactly one completion call
+        assert len(llm_api.calls) == 3
+
+    def test_qa_step(self, llm_api, client, processed_hash):
+        """Step 4: ask questions about the same content."""
+        ANSWER_RESP.register(llm_api)
+
+        qa_data = {
+            "content_hash": processed_hash,
+            "question": "What is Python used for?",
+        }
         qa_response = client.post("/api/ask-question", json=qa_data)
         assert qa_response.status_code == 200
 
-        # All features should work with the same content hash
-        assert all(
-            [
-                process_response.status_code == 200,
-                flashcard_response.status_code == 200,
-                quiz_response.status_code == 200,
-                qa_response.status_code == 200,
-            ]
-        )
-
 
+@pytest.mark.xdist_group("requires_app_patches")
+@pytest.mark.usefixtures("patched_services")
 class TestErrorScenarios:
     """Test various error scenarios in the complete system."""
 
-    def test_missing_environment_variables(self, client):
+    @pytest.mark.serial
+    def test_missing_environment_variables(self, monkeypatch):
         """Test behavior when environment variables are missing."""
-        with patch.dict(os.environ, {}, clear=True):
-            # This should fail gracefully when LLM client can't initialize
-            data = {
-                "file": (io.BytesIO(b"fake pdf"), "test.pdf"),
-                "subject": "Test",
-                "content_hash": "test-hash",
-            }
-            response = client.post(
-                "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
-            )
+        monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+
+        # This should fail gracefully when LLM client can't initialize
+        data = _pdf_form(b"fake pdf", subject="Test", content_hash="test-hash")
+        _, status_code = _call_view(
+            process_pdf_endpoint,
+            "/api/process-pdf",
+            data=data,
+            headers={"X-User-ID": "test-user"},
+        )
 
-            assert response.status_code == 500
+        assert status_code == 500
 
-    @patch("app.supabase")
-    def test_database_connection_failure(self, mock_supabase, client, sample_pdf):
+    def test_database_connection_failure(self, fake_supabase, client, sample_pdf):
         """Test behavior when database is unavailable."""
-        mock_supabase.table().select().eq().execute.side_effect = Exception(
-            "Database unavailable"
-        )
+        fake_supabase.error = Exception("Database unavailable")
 
-        data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Test Subject",
-            "content_hash": "test-hash",
-        }
+        data = _pdf_form(sample_pdf, subject="Test Subject", content_hash="test-hash")
         response = client.post(
             "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
         )
@@ -614,312 +570,228 @@ class TestErrorScenarios:
         assert response.status_code == 500
         assert "Database unavailable" in response.get_json()["error"]
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
+    @pytest.mark.parametrize("endpoint,payload,headers", LLM_FEATURE_REQUESTS)
     def test_llm_api_failure_with_new_features(
-        self, mock_requests_post, mock_supabase, client
+        self, llm_api, fake_supabase, client, endpoint, payload, headers
     ):
         """Test behavior when LLM API fails for new features."""
-        # Mock database responses
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Seed database responses
+        fake_supabase.tables["study_notes"] = [
             {"id": "note-1", "content": "Test content", "model_used": "test"}
         ]
-        mock_supabase.table().select().eq().single().execute.return_value.data = {
-            "subject": "Test",
-            "title": "Test",
-        }
+        fake_supabase.tables["study_materials"] = [
+            {"id": "1", "user_id": "test-user", "subject": "Test", "title": "Test"}
+        ]
 
         # Mock LLM API failure
-        mock_requests_post.side_effect = requests.exceptions.RequestException(
-            "API Error"
-        )
+        API_ERROR_RESP.register(llm_api)
 
-        # Test flashcard generation failure
-        flashcard_data = {"category": "Test Category"}
-        flashcard_response = client.post(
-            "/api/generate-flashcards-from-material/test-hash",
-            json=flashcard_data,
-            headers={"X-User-ID": "test-user"},
-        )
-        assert flashcard_response.status_code == 500
-
-        # Test quiz generation failure
-        quiz_data = {
-            "content_hash": "test-hash",
-            "material_title": "Test",
-            "material_subject": "Test",
-            "quiz_title": "Test Quiz",
-            "user_id": "test-user",
-        }
-        quiz_response = client.post("/generate-quiz", json=quiz_data)
-        assert quiz_response.status_code == 500
-
-        # Test Q&A failure
-        qa_data = {"content_hash": "test-hash", "question": "Test question?"}
-        qa_response = client.post("/api/ask-question", json=qa_data)
-        assert qa_response.status_code == 500
+        response = client.post(endpoint, json=payload, headers=headers)
+        assert response.status_code == 500
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
+    @pytest.mark.parametrize("endpoint,payload,headers", LLM_FEATURE_REQUESTS)
     def test_rate_limiting_across_features(
-        self, mock_requests_post, mock_supabase, client
+        self, llm_api, fake_supabase, client, endpoint, payload, headers
     ):
         """Test rate limiting behavior across all LLM features."""
         # Mock rate limit response
-        mock_rate_limit_response = MagicMock()
-        mock_rate_limit_response.status_code = 429
-        mock_rate_limit_response.text = "Rate limit exceeded"
-        mock_requests_post.return_value = mock_rate_limit_response
+        RATE_LIMIT_RESP.register(llm_api)
 
-        # Mock database responses
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Seed database responses
+        fake_supabase.tables["study_notes"] = [
             {"id": "note-1", "content": "Test content"}
         ]
 
-        # Test all features handle rate limiting gracefully
-        features_to_test = [
-            (
-                "flashcards",
-                "/api/generate-flashcards-from-material/test-hash",
-                "POST",
-                {"X-User-ID": "test-user"},
-            ),
-            ("quiz", "/generate-quiz", "POST", None),
-            ("qa", "/api/ask-question", "POST", None),
-        ]
+        response = client.post(endpoint, json=payload, headers=headers)
 
-        for feature_name, endpoint, method, headers in features_to_test:
-            if feature_name == "quiz":
-                data = {
-                    "content_hash": "test-hash",
-                    "material_title": "Test",
-                    "material_subject": "Test",
-                    "quiz_title": "Test Quiz",
-                    "user_id": "test-user",
-                }
-                response = client.post(endpoint, json=data)
-            elif feature_name == "qa":
-                data = {"content_hash": "test-hash", "question": "Test question?"}
-                response = client.post(endpoint, json=data)
-            else:
-                data = {"category": "Test Category"}
-                response = client.post(endpoint, json=data, headers=headers)
-
-            # Should handle rate limiting gracefully (return 500 with proper error)
-            assert response.status_code == 500
+        # Should handle rate limiting gracefully (return 500 with proper error)
+        assert response.status_code == 500
 
 
+@pytest.mark.integration
+@pytest.mark.usefixtures("patched_services")
 class TestRateLimiting:
     """Test rate limiting and concurrent request handling."""
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    # Update the method signature to accept the mock arguments:
-
-    def test_concurrent_requests(self, mock_post, mock_supabase):  # ✅ Fixed
+    @pytest.mark.serial
+    @pytest.mark.timeout(15)
+    def test_concurrent_requests(self):
         """Test handling multiple simultaneous uploads"""
-        # Create test client within the method
-        with app.test_client() as client:
-            pdf_data = b"%PDF-1.4\nTest content for concurrent testing"
-
-            responses = []
+        pdf_data = b"%PDF-1.4\nTest content for concurrent testing"
+
+        def upload(i):
+            # Each worker gets its own client so request contexts never interleave
+            data = _pdf_form(pdf_data, name=f"test_concurrent_{i}.pdf")
+            return app.test_client().post(
+                "/api/process-pdf",
+                data=data,
+                content_type="multipart/form-data",
+                headers={"X-User-ID": "test-user"},
+            )
 
-            # Make multiple requests
-            for i in range(5):
-                data = {"file": (io.BytesIO(pdf_data), f"test_concurrent_{i}.pdf")}
-                response = client.post(
-                    "/api/process-pdf",
-                    data=data,
-                    content_type="multipart/form-data",
-                    headers={"X-User-ID": "test-user"},
-                )
-                responses.append(response)
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(upload, range(5)))
 
-            # Verify all requests completed
-            assert len(responses) == 5
-            for response in responses:
-                assert response.status_code in [200, 302, 400]
+        # Verify all requests completed
+        assert len(results) == 5
+        for response in results:
+            assert response.status_code in _CONCURRENT_OK
 
 
+@pytest.mark.integration
+@pytest.mark.xdist_group("requires_app_patches")
+@pytest.mark.usefixtures("patched_services")
 class TestDataValidation:
     """Test data validation and sanitization."""
 
-    def test_file_size_limits(self, client):
-        """Test handling of very large files."""
-        # Create a very large fake PDF
-        large_pdf = b"%PDF-1.4\n" + b"A" * (10 * 1024 * 1024)  # 10MB
-
-        data = {
-            "file": (io.BytesIO(large_pdf), "large.pdf"),
-            "subject": "Test Subject",
-            "content_hash": "test-hash",
-        }
+    def test_file_size_limits(self, client, monkeypatch, large_pdf):
+        """Test that uploads over the configured size limit are rejected."""
+        # Lower the limit for this test so a small payload exercises the same
+        # rejection path as a genuinely oversized upload.
+        monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 4096)
+
+        data = _pdf_form(
+            large_pdf,
+            name="large.pdf",
+            subject="Test Subject",
+            content_hash="test-hash",
+        )
         response = client.post(
             "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
         )
 
-        # Should handle large files gracefully (may fail or succeed depending on implementation)
-        assert response.status_code in [200, 400, 413, 500]
-
-    def test_special_characters_in_subject(self, client, sample_pdf):
-        """Test handling of special characters in subject."""
-        data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Test Subject with émojis 🎓📚 and spëcial chars",
-            "content_hash": "test-hash",
-        }
+        assert response.status_code == 413
+
+    @pytest.mark.parametrize(
+        "subject",
+        [
+            "Test Subject with émojis 🎓📚 and spëcial chars",
+            "<script>alert('xss')</script>",
+            "'; DROP TABLE study_materials; --",
+        ],
+    )
+    def test_validates_subject(
+        self, mock_llm_success, fake_supabase, client, sample_pdf, subject
+    ):
+        """Test special characters and hostile input in subject are processed."""
+        data = _pdf_form(sample_pdf, subject=subject, content_hash="test-hash")
         response = client.post(
             "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
         )
 
-        # Should handle special characters without crashing
-        assert response.status_code in [200, 400, 500]
-
-    def test_sql_injection_attempts(self, client):
-        """Test protection against SQL injection attempts."""
-        malicious_hash = "'; DROP TABLE study_notes; --"
-
+        assert response.status_code == 200
+        assert response.get_json()["status"] == "success"
+
+    @pytest.mark.parametrize(
+        "malicious_hash",
+        [
+            "'; DROP TABLE study_notes; --",
+            "1' OR '1'='1",
+            'abc" UNION SELECT * FROM study_materials --',
+        ],
+    )
+    def test_sql_injection_attempts(self, fake_supabase, client, malicious_hash):
+        """Test injection-shaped hashes are treated as plain unknown hashes."""
         response = client.get(f"/api/notes/{malicious_hash}")
 
-        # Should not crash and should return 404 or handle gracefully
-        assert response.status_code in [404, 400, 500]
-        # The important thing is that it doesn't crash the server
+        assert response.status_code == 404
+        assert response.get_json()["error"] == "Notes not found"
 
 
+@pytest.mark.integration
+@pytest.mark.xdist_group("requires_app_patches")
+@pytest.mark.usefixtures("patched_services")
 class TestPerformance:
     """Test performance characteristics."""
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    def test_response_time(self, mock_requests_post, mock_supabase, client, sample_pdf):
-        """Test that responses are returned in reasonable time."""
-        import time
-
-        # Mock responses
-        mock_llm_response = MagicMock()
-        mock_llm_response.status_code = 200
-        mock_llm_response.raise_for_status.return_value = None
-        mock_llm_response.json.return_value = {
-            "choices": [{"message": {"content": "Quick notes"}}]
-        }
-        mock_requests_post.return_value = mock_llm_response
-        mock_supabase.table().select().eq().execute.return_value.data = []
-        mock_supabase.table().insert().execute.return_value = MagicMock()
-
-        start_time = time.time()
+    def test_response_time(
+        self, benchmark, mock_llm_success, fake_supabase, client, sample_pdf
+    ):
+        """Benchmark the PDF processing round trip with mocked services."""
 
-        data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Test Subject",
-            "content_hash": "test-hash",
-        }
-        response = client.post(
-            "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
-        )
+        def process_pdf():
+            data = _pdf_form(
+                sample_pdf, subject="Test Subject", content_hash="test-hash"
+            )
+            return client.post(
+                "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
+            )
 
-        end_time = time.time()
-        response_time = end_time - start_time
+        # Fixed rounds keep the benchmark bounded without relying on ini options
+        response = benchmark.pedantic(process_pdf, rounds=5, iterations=1)
 
         assert response.status_code == 200
-        assert response_time < 5.0  # Should respond within 5 seconds
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    def test_token_limits_across_features(
-        self, mock_requests_post, mock_supabase, client
-    ):
+    @pytest.mark.timeout(15)
+    def test_token_limits_across_features(self, llm_api, fake_supabase, client):
         """Test that all features respect token limits."""
-        import time
-
-        # Create very large content to test token limits
-        large_content = "A" * 5000000  # 5M characters, likely to exceed token limits
-
-        # Mock database responses with large content
-        mock_supabase.table().select().eq().execute.return_value.data = [
-            {"id": "note-1", "content": large_content, "model_used": "test"}
+        # Seed database responses with large content and quiz access
+        fake_supabase.tables["study_notes"] = [
+            {"id": "note-1", "content": LARGE_CONTENT, "model_used": "test"}
         ]
+        fake_supabase.tables["study_materials"] = [{"id": "1", "user_id": "test-user"}]
 
-        # Mock material access check for quiz
-        mock_supabase.table().select().eq().eq().execute.return_value.data = [
-            {"id": "1", "user_id": "test-user"}
+        # Bodies are serialized once up front rather than inside each request
+        requests_to_send = [
+            (
+                "/api/generate-flashcards-from-material/test-hash",
+                orjson.dumps({"category": "Test Category"}),
+                {"X-User-ID": "test-user"},
+            ),
+            (
+                "/generate-quiz",
+                orjson.dumps(
+                    {
+                        "content_hash": "test-hash",
+                        "material_title": "Large Test",
+                        "material_subject": "Test",
+                        "quiz_title": "Large Quiz",
+                        "user_id": "test-user",
+                    }
+                ),
+                None,
+            ),
+            (
+                "/api/ask-question",
+                orjson.dumps(
+                    {"content_hash": "test-hash", "question": "What is this about?"}
+                ),
+                None,
+            ),
         ]
 
-        # Test flashcard generation with large content
-        start_time = time.time()
-        flashcard_data = {"category": "Test Category"}
-        flashcard_response = client.post(
-            "/api/generate-flashcards-from-material/test-hash",
-            json=flashcard_data,
-            headers={"X-User-ID": "test-user"},
-        )
-        flashcard_time = time.time() - start_time
-
-        # Should either succeed or fail gracefully (not crash)
-        assert flashcard_response.status_code in [200, 500]
-        assert flashcard_time < 10.0  # Should not hang indefinitely
-
-        # Test quiz generation with large content
-        start_time = time.time()
-        quiz_data = {
-            "content_hash": "test-hash",
-            "material_title": "Large Test",
-            "material_subject": "Test",
-            "quiz_title": "Large Quiz",
-            "user_id": "test-user",
-        }
-        quiz_response = client.post("/generate-quiz", json=quiz_data)
-        quiz_time = time.time() - start_time
-
-        assert quiz_response.status_code in [200, 500]
-        assert quiz_time < 10.0
+        def send(request_args):
+            # Each worker gets its own client so request contexts never interleave
+            endpoint, body, headers = request_args
+            return app.test_client().post(
+                endpoint, data=body, content_type="application/json", headers=headers
+            )
 
-        # Test Q&A with large content
+        # Fire all three features concurrently; the bound covers the whole batch
         start_time = time.time()
-        qa_data = {"content_hash": "test-hash", "question": "What is this about?"}
-        qa_response = client.post("/api/ask-question", json=qa_data)
-        qa_time = time.time() - start_time
+        with ThreadPoolExecutor(max_workers=len(requests_to_send)) as executor:
+            results = list(executor.map(send, requests_to_send))
+        elapsed = time.time() - start_time
 
-        assert qa_response.status_code in [200, 500]
-        assert qa_time < 10.0
+        # Should either succeed, be rejected as too large, or fail gracefully
+        for response in results:
+            assert response.status_code in _LARGE_OK
+        assert elapsed < 10.0  # Should not hang indefinitely
 
-    @patch.dict(os.environ, {"OPENROUTER_API_KEY": "test-key"})
-    @patch("app.supabase")
-    @patch("requests.post")
-    def test_cost_estimation_workflow(self, mock_requests_post, mock_supabase, client):
+    def test_cost_estimation_workflow(self, llm_api, fake_supabase, client):
         """Test that cost estimation works properly across features."""
         # Mock successful responses that would incur costs
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.raise_for_status.return_value = None
-        mock_response.json.return_value = {
-            "choices": [
-                {
-                    "message": {
-                        "content": '{"flashcards": [{"front": "Test Question", "back": "Test Answer", "category": "Test Category", "difficulty": "easy"}]}'
-                    }
-                }
-            ]
-        }
-        mock_requests_post.return_value = mock_response
+        FLASHCARDS_RESP.register(llm_api)
 
-        # Mock database responses
-        mock_supabase.table().select().eq().execute.return_value.data = [
+        # Seed database responses
+        fake_supabase.tables["study_notes"] = [
             {
                 "content": "Test content for cost estimation",
                 "model_used": "test",
                 "generated_at": "2023-01-01T00:00:00",
             }
         ]
-        mock_supabase.table().select().eq().single().execute.return_value.data = {
-            "subject": "Test",
-            "title": "Test",
-        }
-        mock_supabase.table().insert().execute.return_value.data = [{"id": "1"}]
+        fake_supabase.tables["study_materials"] = [{"subject": "Test", "title": "Test"}]
 
         # Test multiple API calls to simulate cost accumulation
         features = [
@@ -936,7 +808,7 @@ class TestPerformance:
             # Should succeed and consume API quota
             assert response.status_code == 200
             # Verify the API was actually called (cost incurred)
-            mock_requests_post.assert_called()
+            assert len(llm_api.calls) > 0
 
 
 class TestSecurity:
@@ -944,25 +816,26 @@ class TestSecurity:
 
     def test_unauthorized_access(self, client, sample_pdf):
         """Test that requests without user ID are rejected."""
-        data = {
-            "file": (io.BytesIO(sample_pdf), "test.pdf"),
-            "subject": "Test Subject",
-            "content_hash": "test-hash",
-        }
+        data = _pdf_form(sample_pdf, subject="Test Subject", content_hash="test-hash")
         response = client.post("/api/process-pdf", data=data)
 
         assert response.status_code == 401
         assert "User ID not provided" in response.get_json()["error"]
 
-    def test_file_type_validation(self, client):
+    @pytest.mark.parametrize(
+        "filename",
+        ["malicious.html", "payload.js", "report.pdf.exe", "notes.txt"],
+    )
+    def test_file_type_validation(self, client, filename):
         """Test that only PDF files are accepted."""
         malicious_file = b"<script>alert('xss')</script>"
 
-        data = {
-            "file": (io.BytesIO(malicious_file), "malicious.html"),
-            "subject": "Test Subject",
-            "content_hash": "test-hash",
-        }
+        data = _pdf_form(
+            malicious_file,
+            name=filename,
+            subject="Test Subject",
+            content_hash="test-hash",
+        )
         response = client.post(
             "/api/process-pdf", data=data, headers={"X-User-ID": "test-user"}
         )
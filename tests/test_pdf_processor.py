@@ -10,6 +10,7 @@ from utils.pdf_processor import (
     chunk_text,
     generate_content_hash,
     process_pdf,
+    HASH_BLOCK_SIZE,
 )
 
 
@@ -152,6 +153,13 @@ class TestGenerateContentHash:
         expected = hashlib.sha256(text.encode("utf-8")).hexdigest()
         assert result == expected
 
+    def test_generate_hash_spanning_blocks(self):
+        """Test hashing in blocks matches a one-shot hash of multi-block text."""
+        text = "Unicode 世界 🌍 text. " * (HASH_BLOCK_SIZE // 8)
+        result = generate_content_hash(text)
+        expected = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        assert result == expected
+
     def test_generate_hash_consistency(self):
         """Test that the same text always produces the same hash."""
         text = "This is a test text."
@@ -0,0 +1,62 @@
+"""
+Test suite for the token-bucket rate limiter.
+"""
+
+import pytest
+from unittest.mock import patch
+from utils.rate_limiter import TokenBucket
+
+
+class TestTokenBucket:
+    """Test token bucket pacing."""
+
+    def test_burst_available_immediately(self):
+        """Test the full burst can be taken without waiting."""
+        bucket = TokenBucket(60, burst=3)
+
+        assert all(bucket.try_acquire() for _ in range(3))
+        assert bucket.try_acquire() is False
+
+    def test_tokens_refill_over_time(self):
+        """Test tokens come back at the configured rate."""
+        with patch("utils.rate_limiter.time.monotonic") as mock_clock:
+            mock_clock.return_value = 100.0
+            bucket = TokenBucket(60, burst=1)  # one token per second
+            assert bucket.try_acquire() is True
+            assert bucket.try_acquire() is False
+
+            mock_clock.return_value = 101.0
+            assert bucket.try_acquire() is True
+
+    def test_refill_capped_at_burst(self):
+        """Test an idle bucket never holds more than its burst."""
+        with patch("utils.rate_limiter.time.monotonic") as mock_clock:
+            mock_clock.return_value = 0.0
+            bucket = TokenBucket(60, burst=2)
+
+            mock_clock.return_value = 3600.0
+            assert bucket.try_acquire() is True
+            assert bucket.try_acquire() is True
+            assert bucket.try_acquire() is False
+
+    def test_acquire_waits_for_next_token(self):
+        """Test acquire sleeps until a token has refilled."""
+        clock = [0.0]
+
+        def fake_sleep(seconds):
+            clock[0] += seconds
+
+        with patch(
+            "utils.rate_limiter.time.monotonic", side_effect=lambda: clock[0]
+        ), patch("utils.rate_limiter.time.sleep", side_effect=fake_sleep) as sleep:
+            bucket = TokenBucket(120, burst=1)  # one token every 0.5s
+            bucket.acquire()
+            bucket.acquire()
+
+            sleep.assert_called_once_with(pytest.approx(0.5))
+
+    @pytest.mark.parametrize("rate,burst", [(0, 1), (-5, 1), (60, 0)])
+    def test_invalid_configuration(self, rate, burst):
+        """Test non-positive rates and bursts are rejected."""
+        with pytest.raises(ValueError):
+            TokenBucket(rate, burst=burst)
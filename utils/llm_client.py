@@ -1,7 +1,21 @@
 import os
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from typing import Iterator, Optional
+import random
 import re
+import time
+from utils.rate_limiter import TokenBucket
+
+# Patterns used by LLMClient.clean_llm_answer, compiled once at import
+IN_BRIEF_RE = re.compile(r"---\s*\*\*In brief:\*\*.*", re.DOTALL)
+BLANK_RUN_RE = re.compile(r"\n{3,}")
+
+
+class IncompleteStreamError(Exception):
+    """Raised when a notes stream ends without completing its output."""
 
 
 class LLMClient:
@@ -13,6 +27,30 @@ class LLMClient:
     MAX_INPUT_TOKENS = 1000000  # Leave room for output (1,047,576 total)
     MAX_OUTPUT_TOKENS = 33000
 
+    # Largest document (in characters) that fits one call: at ~4 chars/token,
+    # leave room for ~200 prompt tokens and ~8,000 output tokens. Precomputed
+    # so size checks are a single comparison.
+    MAX_SINGLE_CALL_CHARS = (MAX_INPUT_TOKENS - 200 - 8000) * 4 + 3
+
+    # Maximum OpenRouter calls in flight when generating notes for many chunks;
+    # override with LLM_MAX_CONCURRENCY to match the provider plan's limits
+    MAX_CONCURRENCY = 5
+
+    # Client-side pacing so bursts don't turn into 429s; tune per provider plan
+    REQUESTS_PER_MINUTE = 600
+    RATE_LIMIT_BURST = 20
+    # Longest Retry-After we will wait out before giving up on a 429
+    MAX_RETRY_AFTER = 10
+    # (connect, read) timeout for OpenRouter calls that don't set their own;
+    # the read budget covers prefill of a near-1M-token document
+    REQUEST_TIMEOUT = (5, 300)
+
+    # Attempts per call for timeouts, dropped connections and these statuses;
+    # backoff doubles from RETRY_BACKOFF seconds between attempts
+    MAX_ATTEMPTS = 3
+    RETRY_STATUSES = frozenset({500, 502, 503, 504})
+    RETRY_BACKOFF = 0.2
+
     # Cost per 1M tokens
     INPUT_COST_PER_1M = 0.10
     OUTPUT_COST_PER_1M = 0.40
@@ -28,9 +66,102 @@ class LLMClient:
         }
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
 
-    def get_prompt_template(self) -> str:
-        """Enhanced prompt template for GPT-4.1 Nano's capabilities."""
-        return """
+        # Pooled session so repeated calls reuse the OpenRouter connection
+        # instead of paying a DNS lookup and TLS handshake each time. The
+        # adapter never retries; _post owns every retry so attempts don't
+        # multiply.
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=0),
+        )
+        # At least one worker, or the chunk thread pool can't be created
+        self.max_concurrency = max(
+            1, int(os.getenv("LLM_MAX_CONCURRENCY", self.MAX_CONCURRENCY))
+        )
+        self.rate_limiter = TokenBucket(
+            self.REQUESTS_PER_MINUTE, burst=self.RATE_LIMIT_BURST
+        )
+
+    def close(self) -> None:
+        """Release the pooled connections."""
+        self.session.close()
+
+    def __enter__(self) -> "LLMClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _post(self, data: dict, **kwargs) -> requests.Response:
+        """
+        Send a chat completion request to OpenRouter.
+
+        Waits for the rate limiter before every attempt. Timeouts, dropped
+        connections and 5xx responses are retried with jittered exponential
+        backoff; a 429 with a short numeric Retry-After is retried after
+        sleeping that long. After MAX_ATTEMPTS the last response is returned
+        (or the last exception raised) to the caller as-is. Calls without an
+        explicit timeout get REQUEST_TIMEOUT so a stalled connection can't
+        hang a worker.
+        """
+        # Serialize once with orjson; every retry reuses the same bytes
+        body = orjson.dumps(data)
+        kwargs.setdefault("timeout", self.REQUEST_TIMEOUT)
+        # Always make one attempt, so a response or exception is returned
+        max_attempts = max(1, self.MAX_ATTEMPTS)
+        for attempt in range(1, max_attempts + 1):
+            last_attempt = attempt == max_attempts
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.post(
+                    self.api_url, headers=self.headers, data=body, **kwargs
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if last_attempt:
+                    raise
+                delay = self._backoff_seconds(attempt)
+                print(f"⏳ OpenRouter unreachable, retrying in {delay:.2f}s...")
+            else:
+                if response.status_code == 429:
+                    delay = self._retry_after_seconds(response)
+                    if delay is None or delay > self.MAX_RETRY_AFTER:
+                        return response
+                    print(f"⏳ Rate limited by OpenRouter, retrying in {delay:g}s...")
+                elif response.status_code in self.RETRY_STATUSES:
+                    delay = self._backoff_seconds(attempt)
+                    print(
+                        f"⏳ OpenRouter returned {response.status_code}, "
+                        f"retrying in {delay:.2f}s..."
+                    )
+                else:
+                    return response
+                if last_attempt:
+                    return response
+                response.close()
+            if delay:
+                time.sleep(delay)
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        """Exponential backoff with full jitter for the given attempt number."""
+        return random.uniform(0, self.RETRY_BACKOFF * 2 ** (attempt - 1))
+
+    @staticmethod
+    def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+        """Return the Retry-After delay in seconds, if given as a number."""
+        value = response.headers.get("Retry-After")
+        if not isinstance(value, str):
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # HTTP-date form; not worth parsing for a one-off retry
+            return None
+
+    # Stable instructions go in the system message so every chunk of every
+    # document shares an identical prefix the provider can cache; only the
+    # user message varies
+    STUDY_NOTES_SYSTEM_PROMPT = """
 You are an expert study assistant with access to a comprehensive document. Generate detailed, well-structured study notes that cover ALL important content. Use markdown formatting for clarity and organization.
 
 ## Your Task:
@@ -92,11 +223,39 @@ For each major section/topic:
 6. **Preserve exact formulas/equations** when present
 7. **Include all examples** mentioned in the source
 8. **Markdown formatting is required for clarity**
-9. **IMPORTANT**: Do NOT use bullet points directly under main headings. Always use bold subheadings followed by bullet points.
+9. **IMPORTANT**: Do NOT use bullet points directly under main headings. Always use bold subheadings followed by bullet points."""
 
-Document content:
+    STUDY_NOTES_USER_TEMPLATE = """Document content:
 \"\"\"{chunk}\"\"\""""
 
+    # Full single-message form, kept for get_prompt_template() and token estimates
+    STUDY_NOTES_PROMPT = STUDY_NOTES_SYSTEM_PROMPT + "\n\n" + STUDY_NOTES_USER_TEMPLATE
+
+    # Split once so the hot path is a plain concatenation around the chunk
+    _STUDY_NOTES_PREFIX, _STUDY_NOTES_SUFFIX = STUDY_NOTES_USER_TEMPLATE.split(
+        "{chunk}"
+    )
+
+    def get_prompt_template(self) -> str:
+        """Enhanced prompt template for GPT-4.1 Nano's capabilities."""
+        return self.STUDY_NOTES_PROMPT
+
+    def _study_notes_payload(self, chunk: str) -> dict:
+        """Build the chat completion request body for study notes."""
+        prompt = self._STUDY_NOTES_PREFIX + chunk + self._STUDY_NOTES_SUFFIX
+
+        # Enhanced data payload for GPT-4.1 Nano
+        return {
+            "model": self.MODEL,
+            "messages": [
+                {"role": "system", "content": self.STUDY_NOTES_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            "max_tokens": min(8000, self.MAX_OUTPUT_TOKENS),  # Reasonable output size
+            "temperature": 0.3,  # Slightly creative but focused
+            "top_p": 0.9,
+        }
+
     def generate_study_notes(self, chunk: str) -> Optional[str]:
         """
         Generate study notes for a text chunk using GPT-4.1 Nano.
@@ -109,7 +268,7 @@ Document content:
         """
         # Validate chunk size for GPT-4.1 Nano's massive context
         estimated_tokens = self.estimate_tokens(chunk)
-        prompt_tokens = self.estimate_tokens(self.get_prompt_template())
+        prompt_tokens = self.estimate_tokens(self.STUDY_NOTES_PROMPT)
         total_input_tokens = estimated_tokens + prompt_tokens
 
         print(f"📊 Processing with GPT-4.1 Nano:")
@@ -129,21 +288,10 @@ Document content:
         total_estimated_cost = estimated_input_cost + estimated_output_cost
         print(f"💰 Estimated cost: ${total_estimated_cost:.4f}")
 
-        prompt = self.get_prompt_template().format(chunk=chunk)
-
-        # Enhanced data payload for GPT-4.1 Nano
-        data = {
-            "model": self.MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-            "max_tokens": min(8000, self.MAX_OUTPUT_TOKENS),  # Reasonable output size
-            "temperature": 0.3,  # Slightly creative but focused
-            "top_p": 0.9,
-        }
+        data = self._study_notes_payload(chunk)
 
         try:
-            response = requests.post(
-                self.api_url, headers=self.headers, json=data
-            )  # Check for specific error codes
+            response = self._post(data)  # Check for specific error codes
             if response.status_code == 429:
                 print(f"❌ Rate limited by OpenRouter API.")
                 print(f"Response: {response.text}")
@@ -162,7 +310,7 @@ Document content:
                 return None
 
             response.raise_for_status()
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
 
             if "choices" in response_data and len(response_data["choices"]) > 0:
                 content = response_data["choices"][0]["message"]["content"]
@@ -181,10 +329,80 @@ Document content:
                 print(f"Status code: {e.response.status_code}")
                 print(f"Response body: {e.response.text}")
             return None
-        except (KeyError, IndexError) as e:
+        except (KeyError, IndexError, orjson.JSONDecodeError) as e:
             print(f"❌ Error parsing API response: {e}")
             return None
 
+    def stream_study_notes(self, chunk: str) -> Iterator[str]:
+        """
+        Stream study notes for a text chunk as the model produces them.
+
+        Reads OpenRouter's server-sent events and yields each content delta,
+        so callers see the first text after one packet instead of waiting for
+        the whole completion. Yields nothing if the request fails before any
+        text arrives. An error frame, a completion cut off at the token limit,
+        or a stream that breaks after text was yielded raises
+        IncompleteStreamError, so partial notes are never taken as complete.
+
+        Args:
+            chunk: Text chunk to generate notes for
+
+        Yields:
+            Successive pieces of the generated notes
+        """
+        if not self.can_process_entire_document(len(chunk)):
+            print(f"⚠️ Chunk too large to stream. Consider splitting.")
+            return
+
+        data = self._study_notes_payload(chunk)
+        data["stream"] = True
+
+        started = False
+        try:
+            with self._post(data, stream=True) as response:
+                if response.status_code != 200:
+                    print(f"❌ Streaming request failed ({response.status_code})")
+                    print(f"Response: {response.text}")
+                    return
+
+                # text/event-stream has no charset, which requests would
+                # otherwise decode as ISO-8859-1
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    # Blank keep-alives and ": comment" lines carry no data
+                    if not line or not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: ") :]
+                    if payload == "[DONE]":
+                        return
+                    event = orjson.loads(payload)
+                    if event.get("error"):
+                        raise IncompleteStreamError(
+                            f"OpenRouter stream error: {event['error']}"
+                        )
+                    choice = (event.get("choices") or [{}])[0]
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        started = True
+                        yield delta
+                    finish_reason = choice.get("finish_reason")
+                    if finish_reason in ("length", "error"):
+                        raise IncompleteStreamError(
+                            f"Notes stream stopped early (finish_reason={finish_reason})"
+                        )
+
+            if started:
+                raise IncompleteStreamError("Notes stream closed before [DONE]")
+
+        except requests.exceptions.RequestException as e:
+            if started:
+                raise IncompleteStreamError(f"Notes stream interrupted: {e}") from e
+            print(f"❌ Network error streaming from OpenRouter API: {e}")
+        except orjson.JSONDecodeError as e:
+            if started:
+                raise IncompleteStreamError(f"Malformed notes stream: {e}") from e
+            print(f"❌ Error parsing streamed response: {e}")
+
     def generate_notes_for_chunks(self, chunks: "list[str]") -> "list[str]":
         """
         Generate notes for multiple chunks using GPT-4.1 Nano.
@@ -198,12 +416,27 @@ Document content:
         notes = []
         total_cost = 0.0
 
+        if not chunks:
+            return notes
+
         print(f"🚀 Processing {len(chunks)} chunks with GPT-4.1 Nano...")
 
-        for i, chunk in enumerate(chunks):
-            print(f"\n📝 Processing chunk {i + 1}/{len(chunks)}...")
+        # Repeated chunks (e.g. boilerplate pages) are generated once
+        unique_chunks = list(dict.fromkeys(chunks))
+
+        # The calls are network-bound, so overlap them; results keep chunk order
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_concurrency, len(unique_chunks))
+        ) as executor:
+            generated = dict(
+                zip(
+                    unique_chunks,
+                    executor.map(self.generate_study_notes, unique_chunks),
+                )
+            )
+        results = [generated[chunk] for chunk in chunks]
 
-            result = self.generate_study_notes(chunk)
+        for i, (chunk, result) in enumerate(zip(chunks, results)):
             if result:
                 notes.append(result)
                 print(
@@ -271,7 +504,7 @@ Document content:
         }
 
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=test_data)
+            response = self._post(test_data)
 
             if response.status_code == 429:
                 print("❌ Rate limited - free model has strict limits")
@@ -305,12 +538,7 @@ Document content:
         Returns:
             True if can be processed in single call with GPT-4.1 Nano
         """
-        estimated_tokens = document_size_chars // 4
-        prompt_tokens = 200  # Prompt overhead
-        output_tokens = 8000  # Expected output
-        total_tokens = estimated_tokens + prompt_tokens + output_tokens
-
-        return total_tokens <= LLMClient.MAX_INPUT_TOKENS
+        return document_size_chars <= LLMClient.MAX_SINGLE_CALL_CHARS
 
     def get_processing_recommendation(self, document_size_chars: int) -> dict:
         """
@@ -382,9 +610,7 @@ Document content:
 
         return input_cost + output_cost
 
-    def get_flashcard_prompt_template(self) -> str:
-        """Prompt template specifically designed for generating flashcards with structured outputs."""
-        return """You are an expert study assistant specialized in creating effective flashcards for learning and memorization. Generate a set of high-quality flashcards based on the provided study material.
+    FLASHCARD_PROMPT = """You are an expert study assistant specialized in creating effective flashcards for learning and memorization. Generate a set of high-quality flashcards based on the provided study material.
 
 ## Guidelines for Effective Flashcards:
 1. **Focus on key concepts** - Extract the most important information
@@ -415,6 +641,58 @@ Document content:
 Content to create flashcards from:
 \"\"\"{content}\"\"\""""
 
+    # Structured-output schema sent with every flashcard request
+    FLASHCARD_RESPONSE_FORMAT = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "flashcards",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "flashcards": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "front": {
+                                    "type": "string",
+                                    "description": "The question or prompt for the flashcard",
+                                },
+                                "back": {
+                                    "type": "string",
+                                    "description": "The answer or explanation for the flashcard",
+                                },
+                                "category": {
+                                    "type": "string",
+                                    "description": "The subject or topic category",
+                                },
+                                "difficulty": {
+                                    "type": "string",
+                                    "enum": ["easy", "medium", "hard"],
+                                    "description": "The difficulty level of the flashcard",
+                                },
+                            },
+                            "required": [
+                                "front",
+                                "back",
+                                "category",
+                                "difficulty",
+                            ],
+                            "additionalProperties": False,
+                        },
+                    }
+                },
+                "required": ["flashcards"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+    def get_flashcard_prompt_template(self) -> str:
+        """Prompt template specifically designed for generating flashcards with structured outputs."""
+        return self.FLASHCARD_PROMPT
+
     def generate_flashcards(
         self, content: Optional[str], category: Optional[str] = None
     ) -> Optional[list]:
@@ -432,7 +710,7 @@ Content to create flashcards from:
             return None
         # Validate content size
         estimated_tokens = self.estimate_tokens(content)
-        prompt_tokens = self.estimate_tokens(self.get_flashcard_prompt_template())
+        prompt_tokens = self.estimate_tokens(self.FLASHCARD_PROMPT)
         total_input_tokens = estimated_tokens + prompt_tokens
 
         print(f"📚 Generating flashcards with GPT-4.1 Nano:")
@@ -452,7 +730,7 @@ Content to create flashcards from:
         total_estimated_cost = estimated_input_cost + estimated_output_cost
         print(f"💰 Estimated cost: ${total_estimated_cost:.4f}")
 
-        prompt = self.get_flashcard_prompt_template().format(
+        prompt = self.FLASHCARD_PROMPT.format(
             content=content
         )  # Enhanced data payload for flashcard generation with structured outputs
         data = {
@@ -461,56 +739,11 @@ Content to create flashcards from:
             "max_tokens": 3000,  # Enough for multiple flashcards
             "temperature": 0.1,  # Low temperature for consistent formatting
             "top_p": 0.8,
-            "response_format": {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "flashcards",
-                    "strict": True,
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "flashcards": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "front": {
-                                            "type": "string",
-                                            "description": "The question or prompt for the flashcard",
-                                        },
-                                        "back": {
-                                            "type": "string",
-                                            "description": "The answer or explanation for the flashcard",
-                                        },
-                                        "category": {
-                                            "type": "string",
-                                            "description": "The subject or topic category",
-                                        },
-                                        "difficulty": {
-                                            "type": "string",
-                                            "enum": ["easy", "medium", "hard"],
-                                            "description": "The difficulty level of the flashcard",
-                                        },
-                                    },
-                                    "required": [
-                                        "front",
-                                        "back",
-                                        "category",
-                                        "difficulty",
-                                    ],
-                                    "additionalProperties": False,
-                                },
-                            }
-                        },
-                        "required": ["flashcards"],
-                        "additionalProperties": False,
-                    },
-                },
-            },
+            "response_format": self.FLASHCARD_RESPONSE_FORMAT,
         }
 
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=data)
+            response = self._post(data)
 
             # Handle specific error codes
             if response.status_code == 429:
@@ -532,18 +765,23 @@ Content to create flashcards from:
                 return None
 
             response.raise_for_status()
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
 
             if "choices" in response_data and len(response_data["choices"]) > 0:
-                content_result = response_data["choices"][0]["message"]["content"]
+                choice = response_data["choices"][0]
+                # A completion cut off at max_tokens is truncated JSON; skip
+                # parsing (and echoing) a body that can never be valid
+                if choice.get("finish_reason") == "length":
+                    print(f"❌ Flashcard response truncated at max_tokens")
+                    return None
+
+                content_result = choice["message"]["content"]
                 if content_result and content_result.strip():
                     try:
                         # Parse the structured JSON response
-                        import json
-
                         print(f"🔍 Parsing structured output...")
 
-                        response_json = json.loads(content_result)
+                        response_json = orjson.loads(content_result)
 
                         # Extract flashcards from structured response
                         if "flashcards" in response_json and isinstance(
@@ -581,7 +819,7 @@ Content to create flashcards from:
                             print(f"❌ No valid flashcards found in response")
                             return None
 
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         print(f"❌ Error parsing JSON response: {e}")
                         print(f"Raw response: {content_result}")
                         return None
@@ -602,9 +840,7 @@ Content to create flashcards from:
             print(f"❌ Unexpected error: {e}")
             return None
 
-    def get_quiz_prompt_template(self) -> str:
-        """Prompt template specifically designed for generating quiz questions with structured outputs."""
-        return """You are an expert study assistant specialized in creating effective multiple-choice quiz questions for learning assessment. Generate exactly 5 high-quality quiz questions based on the provided study material.
+    QUIZ_PROMPT = """You are an expert study assistant specialized in creating effective multiple-choice quiz questions for learning assessment. Generate exactly 5 high-quality quiz questions based on the provided study material.
 
 ## Guidelines for Effective Quiz Questions:
 1. **Test understanding** - Focus on comprehension, application, and analysis
@@ -635,6 +871,71 @@ Material Title: {title}
 Study Material Content:
 \"\"\"{content}\"\"\""""
 
+    # Structured-output schema sent with every quiz request
+    QUIZ_RESPONSE_FORMAT = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "quiz",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "questions": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "question": {
+                                    "type": "string",
+                                    "description": "The question text",
+                                },
+                                "options": {
+                                    "type": "array",
+                                    "items": {"type": "string"},
+                                    "minItems": 4,
+                                    "maxItems": 4,
+                                    "description": "Exactly 4 answer options",
+                                },
+                                "correct_answer": {
+                                    "type": "integer",
+                                    "minimum": 0,
+                                    "maximum": 3,
+                                    "description": "Index of correct answer (0-3)",
+                                },
+                                "explanation": {
+                                    "type": "string",
+                                    "description": "Brief explanation of correct answer",
+                                },
+                                "difficulty": {
+                                    "type": "string",
+                                    "enum": ["easy", "medium", "hard"],
+                                    "description": "Question difficulty level",
+                                },
+                            },
+                            "required": [
+                                "question",
+                                "options",
+                                "correct_answer",
+                                "explanation",
+                                "difficulty",
+                            ],
+                            "additionalProperties": False,
+                        },
+                        "minItems": 5,
+                        "maxItems": 5,
+                        "description": "Exactly 5 quiz questions",
+                    }
+                },
+                "required": ["questions"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+    def get_quiz_prompt_template(self) -> str:
+        """Prompt template specifically designed for generating quiz questions with structured outputs."""
+        return self.QUIZ_PROMPT
+
     def generate_quiz(self, content: str, subject: str, title: str) -> Optional[list]:
         """
         Generate quiz questions from study content using GPT-4.1 Nano.
@@ -649,7 +950,7 @@ Study Material Content:
         """
         # Validate content size
         estimated_tokens = self.estimate_tokens(content)
-        prompt_tokens = self.estimate_tokens(self.get_quiz_prompt_template())
+        prompt_tokens = self.estimate_tokens(self.QUIZ_PROMPT)
         total_input_tokens = estimated_tokens + prompt_tokens
 
         print(f"🧠 Generating quiz questions with GPT-4.1 Nano:")
@@ -669,9 +970,7 @@ Study Material Content:
         total_estimated_cost = estimated_input_cost + estimated_output_cost
         print(f"💰 Estimated cost: ${total_estimated_cost:.4f}")
 
-        prompt = self.get_quiz_prompt_template().format(
-            content=content, subject=subject, title=title
-        )
+        prompt = self.QUIZ_PROMPT.format(content=content, subject=subject, title=title)
 
         # Enhanced data payload for quiz generation with structured outputs
         data = {
@@ -680,72 +979,12 @@ Study Material Content:
             "max_tokens": 2000,  # Sufficient for 5 questions with explanations
             "temperature": 0.1,  # Low temperature for consistent formatting
             "top_p": 0.8,
-            "response_format": {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "quiz",
-                    "strict": True,
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "questions": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "question": {
-                                            "type": "string",
-                                            "description": "The question text",
-                                        },
-                                        "options": {
-                                            "type": "array",
-                                            "items": {"type": "string"},
-                                            "minItems": 4,
-                                            "maxItems": 4,
-                                            "description": "Exactly 4 answer options",
-                                        },
-                                        "correct_answer": {
-                                            "type": "integer",
-                                            "minimum": 0,
-                                            "maximum": 3,
-                                            "description": "Index of correct answer (0-3)",
-                                        },
-                                        "explanation": {
-                                            "type": "string",
-                                            "description": "Brief explanation of correct answer",
-                                        },
-                                        "difficulty": {
-                                            "type": "string",
-                                            "enum": ["easy", "medium", "hard"],
-                                            "description": "Question difficulty level",
-                                        },
-                                    },
-                                    "required": [
-                                        "question",
-                                        "options",
-                                        "correct_answer",
-                                        "explanation",
-                                        "difficulty",
-                                    ],
-                                    "additionalProperties": False,
-                                },
-                                "minItems": 5,
-                                "maxItems": 5,
-                                "description": "Exactly 5 quiz questions",
-                            }
-                        },
-                        "required": ["questions"],
-                        "additionalProperties": False,
-                    },
-                },
-            },
+            "response_format": self.QUIZ_RESPONSE_FORMAT,
         }
 
         try:
             print(f"🔄 Calling OpenRouter API...")
-            response = requests.post(
-                self.api_url, headers=self.headers, json=data, timeout=60
-            )
+            response = self._post(data, timeout=60)
 
             if response.status_code == 429:
                 print(f"⚠️ Rate limit exceeded. Please wait and try again.")
@@ -760,18 +999,16 @@ Study Material Content:
                 return None
 
             response.raise_for_status()
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
 
             if "choices" in response_data and len(response_data["choices"]) > 0:
                 content_result = response_data["choices"][0]["message"]["content"]
                 if content_result and content_result.strip():
                     try:
                         # Parse the structured JSON response
-                        import json
-
                         print(f"🔍 Parsing structured output...")
 
-                        response_json = json.loads(content_result)
+                        response_json = orjson.loads(content_result)
 
                         # Extract questions from structured response
                         if "questions" in response_json and isinstance(
@@ -813,7 +1050,7 @@ Study Material Content:
                             )
                             return None
 
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         print(f"❌ Error parsing JSON response: {e}")
                         print(f"Raw response: {content_result}")
                         return None
@@ -834,29 +1071,31 @@ Study Material Content:
             print(f"❌ Unexpected error: {e}")
             return None
 
+    QA_PROMPT = (
+        "You are an expert tutor. Given the following study notes, answer the user's question in detail.\n"
+        "\n**Instructions:**\n"
+        "- Use markdown formatting for clarity (headings, bold, italics, lists, code blocks if needed).\n"
+        "- Start with a bolded summary (e.g., **Summary:**) that directly answers the question.\n"
+        "- After the summary, provide a detailed explanation using bullet points or numbered steps.\n"
+        "- Use headings if appropriate for organization.\n"
+        "- Be concise but thorough.\n"
+        "\nStudy Notes:\n{notes}\n\nQuestion:\n{question}\n\nAnswer:"
+    )
+
     def get_qa_prompt_template(self) -> str:
         """Prompt template for answering user questions based on study notes, with best-practice markdown formatting."""
-        return (
-            "You are an expert tutor. Given the following study notes, answer the user's question in detail.\n"
-            "\n**Instructions:**\n"
-            "- Use markdown formatting for clarity (headings, bold, italics, lists, code blocks if needed).\n"
-            "- Start with a bolded summary (e.g., **Summary:**) that directly answers the question.\n"
-            "- After the summary, provide a detailed explanation using bullet points or numbered steps.\n"
-            "- Use headings if appropriate for organization.\n"
-            "- Be concise but thorough.\n"
-            "\nStudy Notes:\n{notes}\n\nQuestion:\n{question}\n\nAnswer:"
-        )
+        return self.QA_PROMPT
 
     def clean_llm_answer(self, answer: str) -> str:
         """
         Post-process the LLM answer to remove repeated summaries, horizontal rules, and extra blank lines.
         """
         # Remove repeated 'In brief' summary at the end
-        answer = re.sub(r"---\s*\*\*In brief:\*\*.*", "", answer, flags=re.DOTALL)
+        answer = IN_BRIEF_RE.sub("", answer)
         # Remove horizontal rules
         answer = answer.replace("---", "")
         # Remove extra blank lines
-        answer = re.sub(r"\n{3,}", "\n\n", answer)
+        answer = BLANK_RUN_RE.sub("\n\n", answer)
         return answer.strip()
 
     def answer_question(self, notes: str, question: str) -> Optional[str]:
@@ -870,17 +1109,19 @@ Study Material Content:
         Returns:
             The LLM's answer as a string, or None if the API call fails
         """
-        prompt = self.get_qa_prompt_template().format(notes=notes, question=question)
+        # Size-check before formatting so oversized notes are rejected without
+        # first being copied into a prompt string
         estimated_tokens = (
             self.estimate_tokens(notes)
             + self.estimate_tokens(question)
-            + self.estimate_tokens(prompt)
+            + self.estimate_tokens(self.QA_PROMPT)
         )
         if estimated_tokens > self.MAX_INPUT_TOKENS:
             print(
                 f"⚠️ Input too large for LLM context window. Consider splitting notes."
             )
             return None
+        prompt = self.QA_PROMPT.format(notes=notes, question=question)
         data = {
             "model": self.MODEL,
             "messages": [{"role": "user", "content": prompt}],
@@ -889,9 +1130,9 @@ Study Material Content:
             "top_p": 0.9,
         }
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=data)
+            response = self._post(data)
             response.raise_for_status()
-            response_data = response.json()
+            response_data = orjson.loads(response.content)
             if "choices" in response_data and len(response_data["choices"]) > 0:
                 content = response_data["choices"][0]["message"]["content"]
                 if content and content.strip():